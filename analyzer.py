@@ -1,11 +1,21 @@
 import gc
+import os
+import uuid
 
 import numpy as np
 from redis import Redis
-from scipy.stats import pearsonr
-import h5py
+from scipy import sparse
 from datetime import datetime, timedelta
 
+from ann import InvertedFileIndex
+from cache import LocalSimilarityCache, RedisSimilarityCache
+from parallel import SharedPool
+from pipeline import Stage
+from factorization import factorize, get_error, init_factors, iter_top_matches
+from recommendation import neighbours_matrix, recommend, recommend_by_factors, recommend_by_items, top_neighbours
+from store import MatrixStore
+from similarity import masked_pearson, iter_masked_pearson_patches, iter_masked_pearson_tiles, merge_top_matches, \
+    mirror_tiles, top_k, UNDEFINED_SIMILARITY
 from utils import log_duration, logger
 
 
@@ -13,182 +23,738 @@ class BangumiAnalyzer:
     def __init__(self, db, conf) -> None:
         self.conf = conf
         self.db = db
-        self.redis = Redis(self.conf.REDIS_HOST, self.conf.REDIS_PORT, db=self.conf.REDIS_DATABASE,
-                           password=self.conf.REDIS_PASSWORD)
-        self.redis.config_set('maxmemory', self.conf.REDIS_MAX_MEMORY)
-        self.redis.config_set('maxmemory-policy', 'allkeys-lru')
+        self.store = MatrixStore(self.conf.HDF5_DIRECTORY, self.conf.ANALYZE_BLOCK_SIZE, self.conf.HDF5_MEMMAP_ENABLE)
+        # Refs Matrix Got by Stage refs_matrix of Current Process.
+        self.refs = None
+
+    @staticmethod
+    def make_refs_matrices(rows_ratings_follow, media_id_indexes, shape):
+        """
+        Build Refs and Watched Matrices of shape from (row, ratings, follow_media_ids) Triples, Rows Not Given are
+        Left Empty.
+        """
+        # Only Non-Zero Entries are Collected.
+        # Watched Animes are Both Reviewed and Followed Ones, Which Will Never be Recommended.
+        rows, cols, data, watched_rows, watched_cols = [], [], [], [], []
+        for row, ratings, follow in rows_ratings_follow:
+            scores = {}
+            for media_id, score in ratings:
+                scores[media_id_indexes[str(media_id)]] = score
+            rows.extend([row] * len(scores))
+            cols.extend(scores.keys())
+            data.extend(scores.values())
+            watched = set(scores.keys()) | set(media_id_indexes[str(media_id)] for media_id in follow
+                                               if str(media_id) in media_id_indexes)
+            watched_rows.extend([row] * len(watched))
+            watched_cols.extend(watched)
+        mat = sparse.csr_matrix((np.array(data, dtype='int8'), (rows, cols)), shape=shape)
+        mat.eliminate_zeros()
+        watched_mat = sparse.csr_matrix((np.ones(len(watched_rows), dtype='int8'), (watched_rows, watched_cols)),
+                                        shape=shape)
+        return mat, watched_mat
+
+    def build_refs_matrix(self):
+        media_ids = [entrance['media_id'] for entrance in self.db.get_all_entrances()]
+        media_id_indexes = {str(media_id): cur for cur, media_id in enumerate(media_ids)}
+        mids, rows_ratings_follow = [], []
+        for mid, ratings, follow in self.db.get_valid_author_ratings_follow_pairs():
+            rows_ratings_follow.append((len(mids), ratings, follow))
+            mids.append(mid)
+        mat, watched_mat = self.make_refs_matrices(rows_ratings_follow, media_id_indexes, (len(mids), len(media_ids)))
+        return mat, watched_mat, media_ids, mids
+
+    def patch_refs_matrix(self, mat, watched_mat, media_ids, mids, since):
+        """
+        Replace Rows of Authors Changed Since Last Build, New Animes and Authors are Appended as Columns and Rows.
+        """
+        media_ids, mids = [self.asscalar(media_id) for media_id in media_ids], [self.asscalar(mid) for mid in mids]
+        known_media_ids = set(media_ids)
+        media_ids.extend(entrance['media_id'] for entrance in self.db.get_all_entrances()
+                         if entrance['media_id'] not in known_media_ids)
+        media_id_indexes = {str(media_id): cur for cur, media_id in enumerate(media_ids)}
+        mid_indexes = {mid: cur for cur, mid in enumerate(mids)}
+        rows_ratings_follow = []
+        for mid, ratings, follow in self.db.get_valid_author_ratings_follow_pairs(since):
+            if mid not in mid_indexes:
+                mid_indexes[mid] = len(mids)
+                mids.append(mid)
+            rows_ratings_follow.append((mid_indexes[mid], ratings, follow))
+        logger.info('%s Authors Changed Since %s, Refs Matrix Will be Patched.' % (len(rows_ratings_follow), since))
+
+        shape = (len(mids), len(media_ids))
+        patch, watched_patch = self.make_refs_matrices(rows_ratings_follow, media_id_indexes, shape)
+        keep = np.ones(shape[0], dtype='int8')
+        keep[[row for row, _, _ in rows_ratings_follow]] = 0
+        keep = sparse.diags(keep, format='csr', dtype='int8')
+        mat, watched_mat = sparse.csr_matrix(mat), sparse.csr_matrix(watched_mat)
+        mat.resize(shape)
+        watched_mat.resize(shape)
+        mat = keep @ mat + patch
+        mat.eliminate_zeros()
+        watched_mat = keep @ watched_mat + watched_patch
+        watched_mat.eliminate_zeros()
+        return mat, watched_mat, media_ids, mids
+
+    @staticmethod
+    def get_refs_versions(old_mat, mat, version, media_ids_version, mids_version):
+        """
+        Version of Every Column (Anime) and Row (Author) of mat, Those Changed from old_mat or Appended are Set to
+        version, so Similarities Derived from an Earlier Version Know Which of Them are Stale.
+        """
+        rows_count, cols_count = mat.shape
+        if old_mat is None or media_ids_version is None or mids_version is None:
+            return np.full(cols_count, version, dtype='int64'), np.full(rows_count, version, dtype='int64')
+        media_ids_version = np.pad(media_ids_version, (0, cols_count - len(media_ids_version)), 'constant',
+                                   constant_values=version)
+        mids_version = np.pad(mids_version, (0, rows_count - len(mids_version)), 'constant', constant_values=version)
+        old_mat = sparse.csr_matrix(old_mat)
+        old_mat.resize(mat.shape)
+        changed = (mat != old_mat).tocoo()
+        media_ids_version[changed.col] = version
+        mids_version[changed.row] = version
+        return media_ids_version, mids_version
 
     @log_duration
     def get_animes_authors_refs_matrix(self):
-        mat, media_ids, mids = None, None, None
+        mat, watched_mat, media_ids, mids, last_build = None, None, None, None, None
+        build, version, media_ids_version, mids_version, watched_version = None, 0, None, None, None
         try:
-            with h5py.File(self.conf.HDF5_FILENAME, 'r') as f:
+            mat, watched_mat, media_ids, mids = self.read_animes_authors_refs_matrix()
+            with self.store.open('animes_authors_refs') as f:
+                build = f.attrs.get('build')
+                if 'version' in f.attrs:
+                    version = int(f.attrs['version'])
+                    media_ids_version, mids_version = np.array(f['media_ids_version']), np.array(f['mids_version'])
+                    watched_version = f.attrs.get('watched_version')
+                if 'last_build' in f.attrs:
+                    last_build = datetime.strptime(f.attrs['last_build'], '%Y-%m-%d %H:%M:%S.%f')
                 last_update = datetime.strptime(f.attrs['last_update'], '%Y-%m-%d %H:%M:%S.%f')
                 if last_update > datetime.now() - timedelta(hours=self.conf.HDF5_DATA_SET_TTL):
-                    mat = np.array(f['animes_authors_refs_matrix'])
-                    media_ids = np.array(f['media_ids'])
-                    mids = np.array(f['mids'])
+                    return mat, watched_mat, media_ids, mids
                 else:
                     raise ValueError('Data Set Expired.')
         except (OSError, KeyError, ValueError) as e:
             logger.warning('Data Set in HDF5 File Will Not be Used for Ref Matrix Because %s.' % e)
 
-        if mat is None or media_ids is None or mids is None:
-            media_ids, media_id_indexes, cur = [], {}, 0
-            for entrance in self.db.get_all_entrances():
-                media_ids.append(entrance['media_id'])
-                media_id_indexes[str(entrance['media_id'])] = cur
-                cur += 1
+        # Changes are Taken from the Moment Before Querying, so Authors Updated While Building are Included Next Time.
+        build_start, old_mat, old_watched_mat = datetime.now(), mat, watched_mat
+        if self.conf.ANALYZE_REFS_INCREMENTAL_ENABLE and mat is not None and last_build is not None:
+            mat, watched_mat, media_ids, mids = self.patch_refs_matrix(mat, watched_mat, media_ids, mids, last_build)
+        else:
+            old_mat = None
+            mat, watched_mat, media_ids, mids = self.build_refs_matrix()
+        # Versions Restart Whenever Built from Scratch, so Derived Matrices Also Check the Build They Come from.
+        if old_mat is None or build is None:
+            build, version, media_ids_version, mids_version = uuid.uuid4().hex, 0, None, None
+            watched_version = None
+        version += 1
+        media_ids_version, mids_version = self.get_refs_versions(old_mat, mat, version, media_ids_version,
+                                                                 mids_version)
+        # Follows Change Recommendation Only, so Watched Matrix is Versioned Apart from Ratings.
+        if watched_version is None or self.is_changed(old_watched_mat, watched_mat):
+            watched_version = version
+        logger.info('Refs Matrix Version %s Got, %s Animes and %s Authors Changed.'
+                    % (version, np.count_nonzero(media_ids_version == version),
+                       np.count_nonzero(mids_version == version)))
 
-            authors_count = self.db.get_authors_count()
-            mat = np.zeros((authors_count, len(media_ids)), dtype='int8')
+        # Similarity Matrices are Kept in Their Own Files, They are Brought Up to Date with This Version When Used.
+        with self.store.create('animes_authors_refs') as f:
+            self.store.write_sparse(f, 'animes_authors_refs_matrix', mat)
+            self.store.write_sparse(f, 'animes_authors_watched_matrix', watched_mat)
+            f.create_dataset('media_ids', data=media_ids)
+            f.create_dataset('mids', data=mids)
+            f.create_dataset('media_ids_version', data=media_ids_version)
+            f.create_dataset('mids_version', data=mids_version)
+            f.attrs['build'] = build
+            f.attrs['version'] = version
+            f.attrs['watched_version'] = watched_version
+            f.attrs['last_build'] = build_start.strftime('%Y-%m-%d %H:%M:%S.%f')
+            # Reused Within HDF5_DATA_SET_TTL Even If Later Stages are Skipped, Which Would Otherwise Mark It.
+            f.attrs['last_update'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')
+        return mat, watched_mat, media_ids, mids
 
-            mids = []
-            cur = 0
-            for mid, reviews, _ in self.db.get_valid_author_ratings_follow_pairs():
-                mids.append(mid)
-                for review in reviews:
-                    index = str(review['media_id'])
-                    mat[cur, media_id_indexes[index]] = review['score']
-                cur += 1
+    @staticmethod
+    def is_changed(old_mat, mat):
+        old_mat = sparse.csr_matrix(old_mat)
+        old_mat.resize(mat.shape)
+        return (mat != old_mat).nnz > 0
 
-            with h5py.File(self.conf.HDF5_FILENAME, 'w') as f:
-                f.create_dataset('animes_authors_refs_matrix', data=mat)
-                f.create_dataset('media_ids', data=media_ids)
-                f.create_dataset('mids', data=mids)
-        return mat, media_ids, mids
+    def read_animes_authors_refs_matrix(self):
+        """
+        Refs Matrix as Stored, Without Checking Whether It Expired.
+        """
+        with self.store.open('animes_authors_refs') as f:
+            return (self.store.read_sparse(f, 'animes_authors_refs_matrix'),
+                    self.store.read_sparse(f, 'animes_authors_watched_matrix'), np.array(f['media_ids']),
+                    np.array(f['mids']))
+
+    def get_refs_changed_version(self):
+        """
+        (build, version) of the Latest Refs Matrix in Which Any Anime or Author Changed, Which Stays the Same Over
+        Builds Changing Nothing, Unlike the Version Itself. None If Versions of Animes and Authors are Not Stored.
+        """
+        with self.store.open('animes_authors_refs') as f:
+            if 'build' not in f.attrs or 'media_ids_version' not in f or 'mids_version' not in f:
+                return None
+            return f.attrs['build'], int(np.concatenate(([0], f['media_ids_version'][...],
+                                                         f['mids_version'][...])).max())
+
+    def get_watched_changed_version(self):
+        """
+        (build, version) of the Latest Refs Matrix in Which Watched Matrix Changed, None If Not Stored.
+        """
+        with self.store.open('animes_authors_refs') as f:
+            if 'build' not in f.attrs or 'watched_version' not in f.attrs:
+                return None
+            return f.attrs['build'], int(f.attrs['watched_version'])
 
     @staticmethod
     def asscalar(value):
-        return np.asscalar(value) if (type(value) != int and type(value) != float) else value
+        return value.item() if (type(value) != int and type(value) != float) else value
 
-    @staticmethod
-    def calc_similarity(lhs, rhs):
-        index = np.logical_and(lhs > 0, rhs > 0)
-        lhs_shared, rhs_shared = lhs[index], rhs[index]
-        return pearsonr(lhs, rhs)[0] if len(lhs_shared) > 1 else -1
+    def get_similarity_cache(self, mids):
+        if self.conf.ANALYZE_SIMILARITY_CACHE == 'redis':
+            redis = Redis(self.conf.REDIS_HOST, self.conf.REDIS_PORT, db=self.conf.REDIS_DATABASE,
+                          password=self.conf.REDIS_PASSWORD)
+            return RedisSimilarityCache(redis, mids, self.conf.REDIS_SIMILARITY_TTL)
+        return LocalSimilarityCache(self.conf.ANALYZE_SIMILARITY_CACHE_SIZE)
+
+    def get_shared_pool(self, **matrices):
+        directory = os.path.abspath(self.conf.HDF5_DIRECTORY)
+        return SharedPool(self.conf.ANALYZE_WORKERS, directory=directory, **matrices)
+
+    def iter_similarity_tiles(self, refs_matrix):
+        """
+        Yield (rows, cols, tile) Covering the Whole Similarity Matrix, Only Tiles on and Above the Diagonal are
+        Calculated and the Others are Their Transposes.
+        """
+        if self.conf.ANALYZE_WORKERS > 1:
+            with self.get_shared_pool(refs=refs_matrix) as pool:
+                yield from mirror_tiles(pool.iter_masked_pearson_tiles(self.conf.ANALYZE_BLOCK_SIZE))
+        else:
+            yield from mirror_tiles(iter_masked_pearson_tiles(refs_matrix, self.conf.ANALYZE_BLOCK_SIZE))
+
+    def iter_recommendations(self, ref_mat, watched_mat, indexes, similarities):
+        block_size, size = self.conf.ANALYZE_BLOCK_SIZE, self.conf.ANALYZE_AUTHOR_RECOMMENDATION_SIZE
+        if self.conf.ANALYZE_WORKERS > 1:
+            with self.get_shared_pool(refs=ref_mat, watched=watched_mat) as pool:
+                yield from pool.iter_recommendations(indexes, similarities, size, block_size)
+        else:
+            for start in range(0, len(indexes), block_size):
+                rows = slice(start, min(start + block_size, len(indexes)))
+                yield (rows,) + recommend(ref_mat, watched_mat, rows, indexes[rows], similarities[rows], size)
+
+    def iter_recommendations_by_items(self, ref_mat, watched_mat, neighbours):
+        block_size, size = self.conf.ANALYZE_BLOCK_SIZE, self.conf.ANALYZE_AUTHOR_RECOMMENDATION_SIZE
+        if self.conf.ANALYZE_WORKERS > 1:
+            with self.get_shared_pool(refs=ref_mat, watched=watched_mat, neighbours=neighbours) as pool:
+                yield from pool.iter_recommendations_by_items(size, block_size)
+        else:
+            for start in range(0, ref_mat.shape[0], block_size):
+                rows = slice(start, min(start + block_size, ref_mat.shape[0]))
+                yield (rows,) + recommend_by_items(ref_mat, watched_mat, rows, neighbours, size)
+
+    def get_refs_version(self, versions_key):
+        """
+        Build and Version of Refs Matrix, and Versions of Its Columns or Rows Stored as versions_key.
+        """
+        with self.store.open('animes_authors_refs') as f:
+            return f.attrs['build'], int(f.attrs['version']), np.array(f[versions_key])
+
+    def mark_updated(self) -> None:
+        with self.store.open('animes_authors_refs', 'r+') as f:
+            f.attrs['last_update'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')
+
+    def get_stale_indexes(self, f, build, versions):
+        """
+        Indexes Whose Similarities in File f are Derived from an Earlier Version of Refs Matrix Than versions, or None
+        If They Should be Calculated from Scratch Because Missing, Derived from Another Build or Mostly Stale.
+        """
+        if 'similarity' not in f or f['similarity'].attrs.get('build') != build or \
+                'version' not in f['similarity'].attrs or f['similarity'].shape[0] > len(versions):
+            return None
+        stale = np.flatnonzero(versions > f['similarity'].attrs['version'])
+        if len(stale) > len(versions) * self.conf.ANALYZE_SIMILARITY_INCREMENTAL_RATIO:
+            return None
+        return stale
+
+    def get_patched_share(self, stale, cols_count):
+        """
+        Share of Tiles of ANALYZE_BLOCK_SIZE Holding a Row or Column of stale in a cols_count Square Matrix.
+        """
+        block_size = self.conf.ANALYZE_BLOCK_SIZE
+        blocks_count = -(-cols_count // block_size)
+        clean_count = blocks_count - len(np.unique(np.asarray(stale) // block_size))
+        return 1 - (clean_count / blocks_count) ** 2 if blocks_count > 0 else 0.0
 
     @log_duration
-    def get_similarity_matrix(self, refs_matrix, dset):
-        mat = None
+    def get_similarity_matrix(self, refs_matrix, name, versions_key):
+        """
+        Similarity Matrix Between Columns of refs_matrix, Only Rows and Columns of Stale Indexes are Recalculated If
+        an Earlier One Stored, and an Up to Date One is Returned Without Being Read.
+        """
+        cols_count, mat, stale = refs_matrix.shape[1], None, None
+        build, version, versions = self.get_refs_version(versions_key)
         try:
-            with h5py.File(self.conf.HDF5_FILENAME, 'r') as f:
-                mat = np.array(f[dset])
+            with self.store.open(name) as f:
+                stale = self.get_stale_indexes(f, build, versions)
+                if stale is not None and len(stale) > 0:
+                    mat = np.full((cols_count, cols_count), UNDEFINED_SIMILARITY, dtype='float64')
+                    stored = f['similarity']
+                    mat[:stored.shape[0], :stored.shape[1]] = stored[...]
         except (OSError, KeyError) as e:
             logger.warning('Data Set in HDF5 File Will Not be Used for Similarity Matrix Because %s.' % e)
 
-        if mat is None:
-            _, cols_count = refs_matrix.shape
-            mat = np.zeros((cols_count, cols_count))
-            for i in range(0, cols_count):
-                logger.info('Calculating Similarities %s/%s...' % (i, cols_count))
-                for j in range(i + 1, cols_count):
-                    mat[i, j] = BangumiAnalyzer.calc_similarity(refs_matrix[:, i], refs_matrix[:, j])
-            mat += mat.T
-            np.fill_diagonal(mat, -1)
-
-            with h5py.File(self.conf.HDF5_FILENAME, 'r+') as f:
-                f.create_dataset(dset, data=mat)
-                f.attrs['last_update'] = str(datetime.now())
+        if stale is not None and len(stale) == 0:
+            return self.store.get_dense(name, 'similarity')
+        if stale is not None:
+            logger.info('Updating Similarities of %s/%s Stale Columns...' % (len(stale), cols_count))
+            for rows, cols, tile, patched in mirror_tiles(iter_masked_pearson_patches(
+                    refs_matrix, stale, self.conf.ANALYZE_BLOCK_SIZE)):
+                mat[rows, cols][patched] = tile[patched]
+        else:
+            logger.info('Calculating Similarities of %s Columns...' % cols_count)
+            if self.conf.ANALYZE_WORKERS > 1:
+                mat = np.empty((cols_count, cols_count))
+                for rows, cols, tile in self.iter_similarity_tiles(refs_matrix):
+                    mat[rows, cols] = tile
+            else:
+                mat = masked_pearson(refs_matrix)
+                np.fill_diagonal(mat, UNDEFINED_SIMILARITY)
+
+        with self.store.create(name) as f:
+            dataset = self.store.create_dense(f, 'similarity', data=mat)
+            dataset.attrs['build'], dataset.attrs['version'] = build, version
+        self.mark_updated()
         return mat
 
     @log_duration
-    def process_animes_top_matches(self, ref_mat, media_ids) -> None:
+    def get_blocked_top_matches(self, refs_matrix, name, top_size, versions_key):
+        """
+        Calculate Similarity Matrix Tile by Tile Into a Chunked, Compressed HDF5 Data Set, Keeping Only Running
+        Top-Matches of Every Row in Memory. If an Earlier One Stored, Only Rows and Columns of Stale Indexes are
+        Recalculated in Place, Then Top-Matches are Selected Again Reading the Data Set Block by Block.
+        """
+        cols_count, block_size = refs_matrix.shape[1], self.conf.ANALYZE_BLOCK_SIZE
+        top_size = min(top_size, cols_count)
+        build, version, versions = self.get_refs_version(versions_key)
+        stale = None
+        if self.store.exists(name):
+            with self.store.open(name) as f:
+                stale = self.get_stale_indexes(f, build, versions)
+                if stale is not None and (f['similarity'].maxshape != (None, None) or 'top_indexes' not in f
+                                          or f['top_indexes'].shape[1] != top_size):
+                    stale = None
+                # Every Tile Holding a Stale Row or Column is Decompressed and Rewritten, Which Takes About 2/3 of
+                # Calculating and Writing It Afresh, and Stale Rows and Columns Take About 3 Times Their Share of
+                # Calculating Afresh (Measured with benchmark.make_ratings), so Scattered Ones are Rebuilt Instead.
+                if stale is not None and 2 / 3 * self.get_patched_share(stale, cols_count) + \
+                        3 * len(stale) / cols_count >= 1:
+                    logger.info('%s/%s Stale Columns Scattered Over Too Many Tiles, Calculating from Scratch...'
+                                % (len(stale), cols_count))
+                    stale = None
+                if stale is not None and len(stale) == 0:
+                    return np.array(f['top_indexes']), np.array(f['top_similarities'])
+
+        if stale is not None:
+            # Updated in Place Rather than Copied, Which is Still Safe to Interrupt: Only Stale Rows and Columns are
+            # Touched and the Version is Written Last, so a Failed Run Leaves Them Stale for the Next One.
+            logger.info('Updating Similarities of %s/%s Stale Columns...' % (len(stale), cols_count))
+            with self.store.open(name, 'r+') as f:
+                mat = f['similarity']
+                mat.resize((cols_count, cols_count))
+                for rows, cols, tile, patched in mirror_tiles(iter_masked_pearson_patches(refs_matrix, stale,
+                                                                                          block_size)):
+                    mat[rows, cols] = np.where(patched, tile, mat[rows, cols])
+                indexes, similarities = top_k(mat, top_size, block_size)
+                for key, data in (('top_indexes', indexes), ('top_similarities', similarities)):
+                    del f[key]
+                    f.create_dataset(key, data=data)
+                mat.attrs['build'], mat.attrs['version'] = build, version
+        else:
+            indexes = np.full((cols_count, top_size), -1, dtype='int64')
+            similarities = np.full((cols_count, top_size), -np.inf)
+            with self.store.create(name) as f:
+                mat = self.store.create_dense(f, 'similarity', shape=(cols_count, cols_count), dtype='float64',
+                                              resizable=True, fillvalue=UNDEFINED_SIMILARITY)
+                for rows, cols, tile in self.iter_similarity_tiles(refs_matrix):
+                    if rows == cols:
+                        logger.info('Calculating Similarities of Rows %s-%s/%s...'
+                                    % (rows.start, rows.stop, cols_count))
+                    mat[rows, cols] = tile
+                    indexes[rows], similarities[rows] = merge_top_matches(
+                        indexes[rows], similarities[rows], np.arange(cols.start, cols.stop), tile)
+                f.create_dataset('top_indexes', data=indexes)
+                f.create_dataset('top_similarities', data=similarities)
+                mat.attrs['build'], mat.attrs['version'] = build, version
+        self.mark_updated()
+        return indexes, similarities
+
+    @log_duration
+    def get_approximate_top_matches(self, refs_matrix, top_size):
+        """
+        Top-Matches Between Rows of refs_matrix Queried from an Inverted File Index Rather than Selected from the
+        Full Similarity Matrix.
+        """
+        index = InvertedFileIndex(self.conf.ANALYZE_ANN_LISTS, self.conf.ANALYZE_ANN_PROBES).fit(refs_matrix)
+        logger.info('Authors Indexed, %.1f Candidates per Author.' % index.candidates_counts.mean())
+        return index.query(top_size, self.conf.ANALYZE_BLOCK_SIZE ** 2)
+
+    def get_animes_similarity_matrix(self, ref_mat):
         logger.info('Calculating Animes Similarity Matrix...')
-        animes_sim_mat = self.get_similarity_matrix(ref_mat, 'animes_similarity_matrix')
+        animes_sim_mat = self.get_similarity_matrix(ref_mat.tocsc(), 'animes_similarity_matrix', 'media_ids_version')
         logger.info('Animes Similarity Matrix %s Calculated.' % str(animes_sim_mat.shape))
-        animes_sim_indexes_mat = np.flip(animes_sim_mat.argsort()[:,
-                                         0 - self.conf.ANALYZE_ANIME_TOP_MATCHES_SIZE:], axis=1)
+        return animes_sim_mat
+
+    def get_animes_top_matches(self, ref_mat):
+        animes_sim_mat = self.get_animes_similarity_matrix(ref_mat)
+        animes_sim_indexes_mat, animes_sim_values_mat = top_k(animes_sim_mat, self.conf.ANALYZE_ANIME_TOP_MATCHES_SIZE,
+                                                              self.conf.ANALYZE_BLOCK_SIZE)
         logger.info('Animes Sim-Indexes %s Get Finished.' % str(animes_sim_indexes_mat.shape))
+        return animes_sim_indexes_mat, animes_sim_values_mat
+
+    def get_animes_neighbours(self, ref_mat):
+        """
+        Sparse Neighbours of Every Anime for Item-Based Mode, Its Top-Matches Among Animes Rated Together with It by
+        at Least ANALYZE_ITEM_MIN_CO_RATERS Authors.
+        """
+        indexes, similarities = top_neighbours(ref_mat, self.get_animes_similarity_matrix(ref_mat),
+                                               self.conf.ANALYZE_ITEM_NEIGHBOURS_SIZE,
+                                               self.conf.ANALYZE_ITEM_MIN_CO_RATERS, self.conf.ANALYZE_BLOCK_SIZE)
+        neighbours = neighbours_matrix(indexes, similarities)
+        logger.info('Animes Neighbours %s Got, with %s Pairs.' % (neighbours.shape, neighbours.nnz))
+        return neighbours
 
-        cur = 0
-        for anime_sim_indexes in animes_sim_indexes_mat:
-            self.db.update_anime_top_matches(self.asscalar(media_ids[cur]), [{
+    @log_duration
+    def process_animes_top_matches(self, ref_mat, media_ids) -> None:
+        animes_sim_indexes_mat, animes_sim_values_mat = self.get_animes_top_matches(ref_mat)
+        self.db.update_animes_top_matches(
+            (self.asscalar(media_ids[i]), [{
                 'media_id': self.asscalar(media_ids[index]),
-                'similarity': self.asscalar(animes_sim_mat[cur, index])
-            } for index in anime_sim_indexes])
-            cur += 1
+                'similarity': self.asscalar(similarity)
+            } for index, similarity in zip(animes_sim_indexes_mat[i, :self.conf.ANALYZE_ANIME_TOP_MATCHES_SIZE],
+                                           animes_sim_values_mat[i, :self.conf.ANALYZE_ANIME_TOP_MATCHES_SIZE])])
+            for i in range(0, len(media_ids)))
         logger.info('Animes Top-Matches Persisted.')
 
-    def process_author_recommendation(self, total_scores_with_weight, total_weight, mid, media_ids, top_matches):
-        recommendation = []
-        recommend_indexes_sorted = np.flip((total_scores_with_weight / total_weight).argsort(), axis=0)
-        author_watched_media_ids = self.db.get_author_watched_media_ids(self.asscalar(mid))
-        for index in recommend_indexes_sorted:
-            if len(recommendation) == self.conf.ANALYZE_AUTHOR_RECOMMENDATION_SIZE:
-                break
-            if media_ids[index] not in author_watched_media_ids:
-                recommendation.append(self.asscalar(media_ids[index]))
-
-        self.db.update_author_recommendation(self.asscalar(mid), top_matches, recommendation)
+    def make_recommendation(self, media_ids, recommend_indexes):
+        return [self.asscalar(media_ids[index]) for index in recommend_indexes if index >= 0]
 
-    @log_duration
-    def process_authors_recommendation(self, ref_mat, media_ids, mids) -> None:
-        logger.info('Calculating Animes Similarities...')
-        try:
-            authors_sim_mat = self.get_similarity_matrix(ref_mat.T, 'authors_similarity_matrix')
+    def get_authors_top_matches(self, ref_mat):
+        if self.conf.ANALYZE_AUTHOR_ANN_ENABLE:
+            authors_sim_indexes_mat, authors_sim_values_mat = self.get_approximate_top_matches(
+                ref_mat, self.conf.ANALYZE_AUTHOR_TOP_MATCHES_SIZE)
+            logger.info('Authors Top-Matches %s Approximated by IVF.' % str(authors_sim_indexes_mat.shape))
+        elif self.conf.ANALYZE_AUTHOR_BLOCKED_ENABLE:
+            authors_sim_indexes_mat, authors_sim_values_mat = self.get_blocked_top_matches(
+                ref_mat.T, 'authors_similarity_matrix', self.conf.ANALYZE_AUTHOR_TOP_MATCHES_SIZE, 'mids_version')
+            logger.info('Authors Top-Matches %s Calculated in Blocks.' % str(authors_sim_indexes_mat.shape))
+        else:
+            authors_sim_mat = self.get_similarity_matrix(ref_mat.T, 'authors_similarity_matrix', 'mids_version')
             logger.info('Authors Similarity Matrix %s Calculated Using Numpy.' % str(authors_sim_mat.shape))
-            authors_sim_indexes_mat = np.flip(authors_sim_mat.argsort()[:,
-                                              0 - self.conf.ANALYZE_AUTHOR_TOP_MATCHES_SIZE:], axis=1)
+            authors_sim_indexes_mat, authors_sim_values_mat = top_k(
+                authors_sim_mat, self.conf.ANALYZE_AUTHOR_TOP_MATCHES_SIZE, self.conf.ANALYZE_BLOCK_SIZE)
             logger.info('Authors Sim-Indexes %s Get Finished.' % str(authors_sim_indexes_mat.shape))
+        return authors_sim_indexes_mat, authors_sim_values_mat
+
+    def iter_authors_recommendation(self, ref_mat, watched_mat, media_ids, mids, authors_top_matches=None):
+        """
+        Yield (mid, top_matches, recommendation) of Every Author, authors_top_matches are Calculated If Not Given.
+        """
+        if authors_top_matches is None:
+            authors_top_matches = self.get_authors_top_matches(ref_mat)
+        authors_sim_indexes_mat, authors_sim_values_mat = authors_top_matches
+        for rows, recommend_indexes_mat, _ in self.iter_recommendations(
+                ref_mat, watched_mat, authors_sim_indexes_mat, authors_sim_values_mat):
+            for i, recommend_indexes in zip(range(rows.start, rows.stop), recommend_indexes_mat):
+                top_matches = [{
+                    'mid': self.asscalar(mids[index]),
+                    'similarity': self.asscalar(similarity)
+                } for index, similarity in zip(authors_sim_indexes_mat[i], authors_sim_values_mat[i])
+                    if i != index and index >= 0]
+                yield self.asscalar(mids[i]), top_matches, self.make_recommendation(media_ids, recommend_indexes)
+
+    def iter_authors_recommendation_by_cache(self, ref_mat, watched_mat, media_ids, mids, cache):
+        """
+        Yield (mid, top_matches, recommendation) of Authors Not Analyzed Recently, One Similarity Row at a Time. Pairs
+        Already in cache are Not Calculated Again, Missing Ones are Calculated Together by masked_pearson.
+        """
+        recently_analyzed_mids = self.db.get_recently_analyzed_mids()
+        cols = np.arange(len(mids))
+        for i in range(0, len(mids)):
+            if self.asscalar(mids[i]) not in recently_analyzed_mids:
+                logger.info("[%s/%s] Calculating %s's Top-Matches and Recommendation..." % (i, len(mids), mids[i]))
+                others = cols[cols != i]
+                similarities = np.empty((len(mids),))
+                similarities[i] = -2
+                similarities[others] = cache.get_row(i, others)
+                missing = others[np.isnan(similarities[others])]
+                if len(missing) > 0:
+                    similarities[missing] = masked_pearson(ref_mat[i].T, ref_mat[missing].T)[0]
+                    cache.set_row(i, missing, similarities[missing])
+                sorted_indexes = top_k(similarities[None, :], self.conf.ANALYZE_AUTHOR_TOP_MATCHES_SIZE)[0][0]
+
+                top_matches = [{'mid': self.asscalar(mids[index]), 'similarity': self.asscalar(similarities[index])}
+                               for index in sorted_indexes if i != index]
+                recommend_indexes, _ = recommend(ref_mat, watched_mat, slice(i, i + 1), sorted_indexes[None, :],
+                                                 similarities[sorted_indexes][None, :],
+                                                 self.conf.ANALYZE_AUTHOR_RECOMMENDATION_SIZE)
+                yield self.asscalar(mids[i]), top_matches, self.make_recommendation(media_ids, recommend_indexes[0])
+            else:
+                logger.info('[%s/%s] Skip Calculating %s.' % (i, len(mids), mids[i]))
+
+    def iter_authors_recommendation_by_items(self, ref_mat, watched_mat, media_ids, mids, neighbours):
+        """
+        Yield (mid, None, recommendation) of Every Author, Recommended by Top-Matches of Animes They Rated Rather than
+        by Similar Authors, so Authors Top-Matches are Left as They Were.
+        """
+        for rows, recommend_indexes_mat, _ in self.iter_recommendations_by_items(ref_mat, watched_mat, neighbours):
+            for i, recommend_indexes in zip(range(rows.start, rows.stop), recommend_indexes_mat):
+                yield self.asscalar(mids[i]), None, self.make_recommendation(media_ids, recommend_indexes)
 
-            total_scores_with_weight, total_weight = 0, 0
-            for i in range(0, len(authors_sim_indexes_mat)):
-                top_matches = []
-                for index in authors_sim_indexes_mat[i]:
-                    if i != index:
-                        similarity = self.asscalar(authors_sim_mat[i, index])
-                        top_matches.append({
-                            'mid': self.asscalar(mids[index]),
-                            'similarity': similarity
-                        })
-                        total_scores_with_weight += similarity * ref_mat[index]
-                        total_weight += similarity
-                self.process_author_recommendation(total_scores_with_weight, total_weight, mids[i], media_ids,
-                                                   top_matches)
+    @log_duration
+    def process_authors_recommendation_by_items(self, ref_mat, watched_mat, media_ids, mids) -> None:
+        logger.info('Recommending Animes by Their Top-Matches...')
+        neighbours = self.get_animes_neighbours(ref_mat)
+        self.db.update_authors_recommendation(
+            self.iter_authors_recommendation_by_items(ref_mat, watched_mat, media_ids, mids, neighbours))
+        logger.info('Authors Recommendation Persisted.')
+
+    def process_authors_recommendation_by_cache(self, ref_mat, watched_mat, media_ids, mids) -> None:
+        logger.info('Calculating Similarities Row by Row with %s Cache.' % self.conf.ANALYZE_SIMILARITY_CACHE.title())
+        cache = self.get_similarity_cache(mids)
+        self.db.update_authors_recommendation(
+            self.iter_authors_recommendation_by_cache(ref_mat, watched_mat, media_ids, mids, cache))
+        logger.info('Similarity Cache: %s.' % cache.report())
+
+    @log_duration
+    def process_authors_recommendation(self, ref_mat, watched_mat, media_ids, mids, authors_top_matches=None) -> None:
+        logger.info('Calculating Authors Similarities...')
+        try:
+            self.db.update_authors_recommendation(
+                self.iter_authors_recommendation(ref_mat, watched_mat, media_ids, mids, authors_top_matches))
         except MemoryError:
-            logger.warning('Memory Error Caught, Using Redis as Cache to Calculate Similarities.')
-            for i in range(0, len(mids)):
-                if self.db.is_need_re_calculate(self.asscalar(mids[i])):
-                    logger.info("[%s/%s] Calculating %s's Top-Matches and Recommendation..." % (i, len(mids), mids[i]))
-                    similarities = np.empty((len(mids),))
-                    similarities[i] = -2
-                    for j in range(0, len(mids)):
-                        if i != j:
-                            index_pair = '%s:%s' % (mids[min(i, j)], mids[max(i, j)])
-                            similarity = self.redis.get(index_pair)
-                            if similarity is None:
-                                similarity = self.calc_similarity(ref_mat[i], ref_mat[j])
-                                self.redis.set(index_pair, similarity)
-                                self.redis.expire(index_pair, self.conf.REDIS_SIMILARITY_TTL)
-                            similarities[j] = similarity
-                    sorted_indexes = np.flip(similarities.argsort(),
-                                             axis=0)[0 - self.conf.ANALYZE_AUTHOR_TOP_MATCHES_SIZE:]
-
-                    top_matches, recommendation = [], []
-                    total_scores_with_weight, total_weight = 0, 0
-                    for index in sorted_indexes:
-                        if i != index:
-                            similarity = self.asscalar(similarities[index])
-                            top_matches.append({'mid': self.asscalar(mids[index]), 'similarity': similarity})
-                            total_scores_with_weight += similarity * ref_mat[index]
-                            total_weight += similarity
-                    self.process_author_recommendation(total_scores_with_weight, total_weight, mids[i], media_ids,
-                                                       top_matches)
-                else:
-                    logger.info('[%s/%s] Skip Calculating %s.' % (i, len(mids), mids[i]))
+            logger.warning('Memory Error Caught.')
+            self.process_authors_recommendation_by_cache(ref_mat, watched_mat, media_ids, mids)
         logger.info('Authors Top-Matches Persisted.')
 
     def analyze(self) -> None:
         logger.info('New Analyze Beginning...')
 
         logger.info('Getting Ref Matrix...')
-        ref_mat, media_ids, mids = self.get_animes_authors_refs_matrix()
-        logger.info('Ref Matrix %s Got, with %s Medias and %s Authors.'
-                    % (ref_mat.shape, len(media_ids), len(mids)))
+        ref_mat, watched_mat, media_ids, mids = self.get_animes_authors_refs_matrix()
+        logger.info('Ref Matrix %s Got, with %s Medias, %s Authors and %s Ratings.'
+                    % (ref_mat.shape, len(media_ids), len(mids), ref_mat.nnz))
 
-        self.process_animes_top_matches(ref_mat, media_ids)
-        self.process_authors_recommendation(ref_mat, media_ids, mids)
+        self.process(ref_mat, watched_mat, media_ids, mids)
 
         logger.info('Analyzing Tasks Finished.')
         gc.collect()
+
+    def process(self, ref_mat, watched_mat, media_ids, mids) -> None:
+        self.process_animes_top_matches(ref_mat, media_ids)
+        if self.conf.ANALYZE_AUTHOR_RECOMMENDATION_MODE == 'item':
+            self.process_authors_recommendation_by_items(ref_mat, watched_mat, media_ids, mids)
+        else:
+            self.process_authors_recommendation(ref_mat, watched_mat, media_ids, mids)
+
+    def get_refs(self):
+        if self.refs is None:
+            self.refs = self.read_animes_authors_refs_matrix()
+        return self.refs
+
+    def get_refs_stages(self, inputs):
+        """
+        Stage refs_matrix Building Refs Matrix After Stages inputs, Whose Version Changes with Ratings Only, and Stage
+        watched_matrix Whose Version Changes with Watched Matrix, so Stages Depending on Follows Too are Not Skipped
+        When Only Those Changed.
+        """
+        def refs_matrix(_):
+            self.refs = self.get_animes_authors_refs_matrix()
+            logger.info('Ref Matrix %s Got, with %s Ratings.' % (self.refs[0].shape, self.refs[0].nnz))
+            return self.get_refs_changed_version()
+
+        def watched_matrix(_):
+            return self.get_watched_changed_version()
+
+        return [Stage('refs_matrix', refs_matrix, inputs), Stage('watched_matrix', watched_matrix, inputs)]
+
+    def get_stages(self, inputs=()):
+        """
+        Analyzing Stages of pipeline.Pipeline, Refs Matrix is Built After Stages inputs, and Each Later Stage is
+        Skipped If Ratings Did Not Change, or Follows Too for write_back. Authors Top-Matches are Kept in HDF5 File
+        Between author_similarity and write_back, so a Failed Write-Back Resumes Without Calculating Them Again.
+        """
+        def anime_similarity(_):
+            ref_mat, _, media_ids, _ = self.get_refs()
+            self.process_animes_top_matches(ref_mat, media_ids)
+
+        def author_similarity(_):
+            ref_mat = self.get_refs()[0]
+            with self.store.create('authors_top_matches') as f:
+                try:
+                    indexes, similarities = self.get_authors_top_matches(ref_mat)
+                except MemoryError:
+                    # Left Without Top-Matches, so write_back Falls Back to Calculating Row by Row.
+                    logger.warning('Memory Error Caught, Authors Top-Matches Will be Calculated When Written Back.')
+                    return
+                f.create_dataset('top_indexes', data=indexes)
+                f.create_dataset('top_similarities', data=similarities)
+
+        def write_back(_):
+            ref_mat, watched_mat, media_ids, mids = self.get_refs()
+            if self.conf.ANALYZE_AUTHOR_RECOMMENDATION_MODE == 'item':
+                self.process_authors_recommendation_by_items(ref_mat, watched_mat, media_ids, mids)
+                return
+            with self.store.open('authors_top_matches') as f:
+                authors_top_matches = (np.array(f['top_indexes']), np.array(f['top_similarities'])) \
+                    if 'top_indexes' in f else None
+            if authors_top_matches is None:
+                self.process_authors_recommendation_by_cache(ref_mat, watched_mat, media_ids, mids)
+            else:
+                self.process_authors_recommendation(ref_mat, watched_mat, media_ids, mids, authors_top_matches)
+
+        conf = self.conf
+        stages = self.get_refs_stages(inputs) + [Stage('anime_similarity', anime_similarity, ['refs_matrix'], {
+            'size': conf.ANALYZE_ANIME_TOP_MATCHES_SIZE
+        })]
+        if conf.ANALYZE_AUTHOR_RECOMMENDATION_MODE == 'item':
+            return stages + [Stage('write_back', write_back, ['refs_matrix', 'watched_matrix'], {
+                'mode': 'item', 'neighbours': conf.ANALYZE_ITEM_NEIGHBOURS_SIZE,
+                'min_co_raters': conf.ANALYZE_ITEM_MIN_CO_RATERS,
+                'size': conf.ANALYZE_AUTHOR_RECOMMENDATION_SIZE
+            })]
+        return stages + [Stage('author_similarity', author_similarity, ['refs_matrix'], {
+            'ann': conf.ANALYZE_AUTHOR_ANN_ENABLE, 'lists': conf.ANALYZE_ANN_LISTS, 'probes': conf.ANALYZE_ANN_PROBES,
+            'blocked': conf.ANALYZE_AUTHOR_BLOCKED_ENABLE, 'size': conf.ANALYZE_AUTHOR_TOP_MATCHES_SIZE
+        }), Stage('write_back', write_back, ['author_similarity', 'watched_matrix'], {
+            'mode': 'user', 'size': conf.ANALYZE_AUTHOR_RECOMMENDATION_SIZE
+        })]
+
+
+class FactorizationAnalyzer(BangumiAnalyzer):
+    """
+    Analyzer Recommending by Embeddings of Authors and Animes Factorized from Refs Matrix Rather than by Their
+    Neighbourhoods, so No Similarity Matrix is Calculated. Embeddings are Stored in HDF5 File and Warm Start the Next
+    Run, and Animes Top-Matches are Those of Closest Embeddings by Cosine.
+    """
+
+    def get_warm_animes_factors(self, f, media_ids, rank):
+        """
+        Stored Animes Factors Rearranged to media_ids, Animes Not Stored are Drawn Randomly.
+        """
+        animes_factors = init_factors(len(media_ids), rank)
+        stored_indexes = {self.asscalar(media_id): cur for cur, media_id in enumerate(f['media_ids'])}
+        indexes = [(cur, stored_indexes[self.asscalar(media_id)]) for cur, media_id in enumerate(media_ids)
+                   if self.asscalar(media_id) in stored_indexes]
+        if len(indexes) > 0:
+            indexes = np.array(indexes)
+            animes_factors[indexes[:, 0]] = np.array(f['animes_factors'])[indexes[:, 1]]
+        logger.info('Factors of %s/%s Animes Warm Started.' % (len(indexes), len(media_ids)))
+        return animes_factors
+
+    @log_duration
+    def get_factors(self, ref_mat, media_ids, mids):
+        """
+        (mean, authors_factors, animes_factors) of Refs Matrix, Trained Again Only If It Changed Since Stored.
+        """
+        rank = self.conf.ANALYZE_FACTORIZATION_RANK
+        build, version, _ = self.get_refs_version('mids_version')
+        animes_factors = None
+        try:
+            with self.store.open('factorization') as f:
+                if f['animes_factors'].shape[1] == rank:
+                    if f.attrs.get('build') == build and f.attrs['version'] == version and \
+                            f['authors_factors'].shape[0] == len(mids):
+                        logger.info('Factors Up to Date with Refs Matrix Version %s.' % version)
+                        return float(f.attrs['mean']), np.array(f['authors_factors']), np.array(f['animes_factors'])
+                    animes_factors = self.get_warm_animes_factors(f, media_ids, rank)
+        except (OSError, KeyError) as e:
+            logger.warning('Data Set in HDF5 File Will Not be Used for Factors Because %s.' % e)
+
+        iterations = self.conf.ANALYZE_FACTORIZATION_ITERATIONS if animes_factors is None \
+            else self.conf.ANALYZE_FACTORIZATION_WARM_ITERATIONS
+        mean, authors_factors, animes_factors = factorize(
+            ref_mat, rank, iterations, self.conf.ANALYZE_FACTORIZATION_REGULARIZATION,
+            max(1, self.conf.ANALYZE_BLOCK_SIZE ** 2 // rank), animes_factors)
+        logger.info('Factors of Rank %s Trained by %s Iterations, RMSE %.4f.'
+                    % (rank, iterations, get_error(ref_mat, mean, authors_factors, animes_factors)))
+
+        with self.store.create('factorization') as f:
+            self.store.create_dense(f, 'authors_factors', data=authors_factors)
+            self.store.create_dense(f, 'animes_factors', data=animes_factors)
+            f.create_dataset('media_ids', data=media_ids)
+            f.create_dataset('mids', data=mids)
+            f.attrs['mean'] = mean
+            f.attrs['build'], f.attrs['version'] = build, version
+        self.mark_updated()
+        return mean, authors_factors, animes_factors
+
+    @log_duration
+    def process_animes_top_matches_by_factors(self, animes_factors, media_ids) -> None:
+        def iter_animes_top_matches():
+            for rows, indexes, similarities in iter_top_matches(
+                    animes_factors, self.conf.ANALYZE_ANIME_TOP_MATCHES_SIZE, self.conf.ANALYZE_BLOCK_SIZE):
+                for i, row_indexes, row_similarities in zip(range(rows.start, rows.stop), indexes, similarities):
+                    yield self.asscalar(media_ids[i]), [{
+                        'media_id': self.asscalar(media_ids[index]),
+                        'similarity': self.asscalar(similarity)
+                    } for index, similarity in zip(row_indexes, row_similarities)]
+
+        self.db.update_animes_top_matches(iter_animes_top_matches())
+        logger.info('Animes Top-Matches Persisted.')
+
+    def iter_authors_recommendation_by_factors(self, mean, authors_factors, animes_factors, watched_mat, media_ids,
+                                               mids):
+        """
+        Yield (mid, None, recommendation) of Every Author, Authors Top-Matches are Left as They Were.
+        """
+        block_size, size = self.conf.ANALYZE_BLOCK_SIZE, self.conf.ANALYZE_AUTHOR_RECOMMENDATION_SIZE
+        for start in range(0, len(mids), block_size):
+            rows = slice(start, min(start + block_size, len(mids)))
+            recommend_indexes_mat, _ = recommend_by_factors(mean, authors_factors, animes_factors, watched_mat, rows,
+                                                            size)
+            for i, recommend_indexes in zip(range(rows.start, rows.stop), recommend_indexes_mat):
+                yield self.asscalar(mids[i]), None, self.make_recommendation(media_ids, recommend_indexes)
+
+    @log_duration
+    def process_authors_recommendation_by_factors(self, mean, authors_factors, animes_factors, watched_mat,
+                                                  media_ids, mids) -> None:
+        self.db.update_authors_recommendation(self.iter_authors_recommendation_by_factors(
+            mean, authors_factors, animes_factors, watched_mat, media_ids, mids))
+        logger.info('Authors Recommendation Persisted.')
+
+    def process(self, ref_mat, watched_mat, media_ids, mids) -> None:
+        mean, authors_factors, animes_factors = self.get_factors(ref_mat, media_ids, mids)
+        self.process_animes_top_matches_by_factors(animes_factors, media_ids)
+        self.process_authors_recommendation_by_factors(mean, authors_factors, animes_factors, watched_mat, media_ids,
+                                                       mids)
+
+    def get_stages(self, inputs=()):
+        """
+        Analyzing Stages of pipeline.Pipeline, Factors are Trained After Refs Matrix Built, and Top-Matches and
+        Recommendation are Made from Factors Stored, Each Skipped If Those, or Follows Too for write_back, Did Not
+        Change.
+        """
+        def factors(_):
+            ref_mat, _, media_ids, mids = self.get_refs()
+            self.get_factors(ref_mat, media_ids, mids)
+
+        def anime_similarity(_):
+            ref_mat, _, media_ids, mids = self.get_refs()
+            self.process_animes_top_matches_by_factors(self.get_factors(ref_mat, media_ids, mids)[2], media_ids)
+
+        def write_back(_):
+            ref_mat, watched_mat, media_ids, mids = self.get_refs()
+            mean, authors_factors, animes_factors = self.get_factors(ref_mat, media_ids, mids)
+            self.process_authors_recommendation_by_factors(mean, authors_factors, animes_factors, watched_mat,
+                                                           media_ids, mids)
+
+        conf = self.conf
+        return self.get_refs_stages(inputs) + [Stage('factors', factors, ['refs_matrix'], {
+            'rank': conf.ANALYZE_FACTORIZATION_RANK, 'regularization': conf.ANALYZE_FACTORIZATION_REGULARIZATION
+        }), Stage('anime_similarity', anime_similarity, ['factors'], {
+            'size': conf.ANALYZE_ANIME_TOP_MATCHES_SIZE
+        }), Stage('write_back', write_back, ['factors', 'watched_matrix'], {
+            'size': conf.ANALYZE_AUTHOR_RECOMMENDATION_SIZE
+        })]
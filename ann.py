@@ -0,0 +1,111 @@
+import numpy as np
+from scipy import sparse
+
+from similarity import merge_top_matches, top_k
+
+
+def center_and_normalize(mat):
+    """
+    Subtract Every Row's Mean Over Its Rated (Non-Zero) Entries and Scale It to Unit Length, Keeping It Sparse.
+    Rows Left All Zero, Such as Those with a Single Distinct Rating, are Returned as Zero Vectors.
+    """
+    mat = sparse.csr_matrix(mat, dtype='float64', copy=True)
+    mat.eliminate_zeros()
+    counts = np.diff(mat.indptr)
+    means = np.asarray(mat.sum(axis=1)).ravel() / np.maximum(counts, 1)
+    mat.data -= np.repeat(means, counts)
+    norms = np.sqrt(np.asarray(mat.multiply(mat).sum(axis=1)).ravel())
+    mat.data /= np.repeat(np.where(norms > 0, norms, 1), counts)
+    mat.eliminate_zeros()
+    return mat
+
+
+class InvertedFileIndex:
+    """
+    Inverted File (IVF) Index over Mean-Centred, Normalized Rating Rows for Approximate Top-Matches.
+
+    Rows are Clustered by Spherical k-Means Into lists Lists, and Every Row is Compared Only with Members of the
+    probes Lists Whose Centroids are Closest to It, so Cost is About probes / lists of the Exact One. Similarity is
+    the Centred Cosine of Rows, Not the Co-Rated Pearson of the Exact Path: Unrated Entries Count as the Author's
+    Mean Rather than Being Left Out, so a Match Needs Enough Overlap to Score High.
+    """
+
+    def __init__(self, lists, probes, iterations=8, seed=None) -> None:
+        self.lists = lists
+        self.probes = probes
+        self.iterations = iterations
+        self.random = np.random.RandomState(seed)
+        self.vectors = None
+        self.centroids = None
+        self.assignments = None
+        self.probed_lists = None
+        self.candidates_counts = None
+
+    def fit(self, refs):
+        """
+        Index Rows of refs (Authors x Animes), Rows Without a Defined Direction are Neither Listed Nor Queried.
+        """
+        self.vectors = center_and_normalize(refs)
+        defined = np.flatnonzero(np.diff(self.vectors.indptr) > 0)
+        if len(defined) == 0:
+            self.centroids = np.zeros((1, self.vectors.shape[1]))
+        else:
+            seeds = self.random.choice(defined, min(self.lists, len(defined)), replace=False)
+            self.centroids = self.vectors[seeds].toarray()
+        for _ in range(self.iterations):
+            self.assign(defined)
+            members = sparse.csr_matrix((np.ones(len(defined)), (self.assignments[defined], defined)),
+                                        shape=(len(self.centroids), self.vectors.shape[0]))
+            sums = np.asarray((members @ self.vectors).todense())
+            norms = np.linalg.norm(sums, axis=1)
+            # Centroids of Lists Left Empty are Kept as They are.
+            self.centroids[norms > 0] = sums[norms > 0] / norms[norms > 0, None]
+        scores = self.assign(defined)
+
+        probes = min(self.probes, len(self.centroids))
+        self.probed_lists = np.full((self.vectors.shape[0], probes), -1, dtype='int64')
+        self.probed_lists[defined] = top_k(scores[defined], probes)[0]
+        sizes = np.bincount(self.assignments[defined], minlength=len(self.centroids))
+        self.candidates_counts = np.zeros(self.vectors.shape[0], dtype='int64')
+        self.candidates_counts[defined] = sizes[self.probed_lists[defined]].sum(axis=1) - 1
+        return self
+
+    def assign(self, defined):
+        scores = np.asarray(self.vectors @ self.centroids.T)
+        self.assignments = np.full(self.vectors.shape[0], -1, dtype='int64')
+        self.assignments[defined] = scores[defined].argmax(axis=1)
+        return scores
+
+    def query(self, k, max_pairs):
+        """
+        Approximate Top-k Matches of Every Indexed Row as (indexes, similarities), Best First. Every List is Compared
+        with Rows Probing It Tile by Tile, at Most About max_pairs Pairs Each, Which Bounds Memory. Slots Without a
+        Match Get Index -1 and Similarity -inf.
+        """
+        indexes = np.full((self.vectors.shape[0], k), -1, dtype='int64')
+        similarities = np.full((self.vectors.shape[0], k), -np.inf)
+        for probed_list in range(len(self.centroids)):
+            members = np.flatnonzero(self.assignments == probed_list)
+            queries = np.flatnonzero((self.probed_lists == probed_list).any(axis=1))
+            if len(members) == 0 or len(queries) == 0:
+                continue
+            members_vectors = self.vectors[members].T.tocsc()
+            step = max(1, max_pairs // len(members))
+            for start in range(0, len(queries), step):
+                rows = queries[start:start + step]
+                tile = (self.vectors[rows] @ members_vectors).toarray()
+                tile[rows[:, None] == members[None, :]] = -np.inf
+                indexes[rows], similarities[rows] = merge_top_matches(indexes[rows], similarities[rows], members, tile)
+        indexes[~np.isfinite(similarities)] = -1
+        return indexes, similarities
+
+
+def recall(exact_similarities, similarities):
+    """
+    Share of Approximate Top-Matches at Least as Similar as the k-th Exact One, Counting Ties as Found. Slots of
+    Exact Top-Matches Without a Match (-inf) are Not Expected.
+    """
+    threshold = exact_similarities[:, -1:]
+    found = np.logical_and(similarities >= threshold, np.isfinite(similarities))
+    expected = np.sum(np.isfinite(exact_similarities), axis=1)
+    return np.sum(np.minimum(found.sum(axis=1), expected)) / max(np.sum(expected), 1)
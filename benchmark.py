@@ -0,0 +1,189 @@
+import argparse
+import time
+
+import numpy as np
+from scipy import sparse
+
+from ann import InvertedFileIndex, center_and_normalize, recall
+from factorization import factorize
+from recommendation import item_scores, neighbours_matrix, select, top_neighbours, weighted_scores
+from similarity import iter_masked_pearson_tiles, masked_pearson, merge_top_matches, mirror_tiles, UNDEFINED_SIMILARITY
+from utils import logger
+
+
+def make_ratings(authors, animes, density, rank=8, seed=0):
+    """
+    Synthetic Authors x Animes Ratings in 1-10 from Low-Rank Tastes Plus Noise, Popular Animes Rated More Often.
+    """
+    random = np.random.RandomState(seed)
+    tastes, traits = random.standard_normal((authors, rank)), random.standard_normal((animes, rank))
+    popularity = random.pareto(1.5, animes) + 1
+    probabilities = np.minimum(1, density * popularity / popularity.mean())
+    rated = random.random_sample((authors, animes)) < probabilities
+    rows, cols = np.nonzero(rated)
+    scores = 5.5 + 1.5 * np.sum(tastes[rows] * traits[cols], axis=1) / np.sqrt(rank) + random.normal(0, 1, len(rows))
+    scores = np.clip(np.round(scores), 1, 10).astype('int8')
+    return sparse.csr_matrix((scores, (rows, cols)), shape=(authors, animes))
+
+
+def get_exact_top_matches(refs, k, block_size):
+    """
+    Top-Matches of the Exact Blocked Path (Co-Rated Pearson), Tile by Tile so Memory Stays Bounded.
+    """
+    indexes = np.full((refs.shape[0], k), -1, dtype='int64')
+    similarities = np.full((refs.shape[0], k), -np.inf)
+    for rows, cols, tile in mirror_tiles(iter_masked_pearson_tiles(refs.T, block_size)):
+        indexes[rows], similarities[rows] = merge_top_matches(
+            indexes[rows], similarities[rows], np.arange(cols.start, cols.stop), tile)
+    return indexes, similarities
+
+
+def get_cosine_top_matches(refs, k, block_size):
+    """
+    Exact Top-Matches by Centred Cosine, the Similarity the IVF Index Approximates, Block by Block of Rows.
+    """
+    vectors = center_and_normalize(refs)
+    indexes = np.full((refs.shape[0], k), -1, dtype='int64')
+    similarities = np.full((refs.shape[0], k), -np.inf)
+    defined = np.diff(vectors.indptr) > 0
+    for start in range(0, refs.shape[0], block_size):
+        rows = slice(start, min(start + block_size, refs.shape[0]))
+        block = (vectors[rows] @ vectors.T).toarray()
+        block[:, ~defined] = -np.inf
+        block[np.arange(block.shape[0]), np.arange(rows.start, rows.stop)] = -np.inf
+        block[~defined[rows]] = -np.inf
+        indexes[rows], similarities[rows] = merge_top_matches(
+            indexes[rows], similarities[rows], np.arange(refs.shape[0]), block)
+    indexes[~np.isfinite(similarities)] = -1
+    return indexes, similarities
+
+
+def get_overlap(exact_indexes, indexes):
+    """
+    Share of Exact Top-Matches Also Returned, Regardless of Order.
+    """
+    return np.mean([len(np.intersect1d(lhs[lhs >= 0], rhs[rhs >= 0])) / max(np.sum(lhs >= 0), 1)
+                    for lhs, rhs in zip(exact_indexes, indexes)])
+
+
+def benchmark_ann(refs, cosine_similarities, pearson_indexes, k, lists, probes, block_size):
+    start = time.perf_counter()
+    index = InvertedFileIndex(lists, probes, seed=0).fit(refs)
+    indexes, similarities = index.query(k, block_size ** 2)
+    duration = time.perf_counter() - start
+    logger.info('IVF with %s Lists, %s Probes: %.3fs, %.1f Candidates per Author, Recall of Exact Cosine %.4f, '
+                'Overlap with Pearson %.4f.' % (lists, probes, duration, index.candidates_counts.mean(),
+                                                recall(cosine_similarities, similarities),
+                                                get_overlap(pearson_indexes, indexes)))
+
+
+def split_ratings(refs, ratio, seed=0):
+    """
+    Hold Out About ratio of Ratings of Every Author as (train, test), Authors Keep at Least One Rating to Train.
+    """
+    random = np.random.RandomState(seed)
+    refs = sparse.csr_matrix(refs)
+    held_out = random.random_sample(refs.nnz) < ratio
+    # First Rating of Every Author is Never Held Out.
+    held_out[refs.indptr[:-1][np.diff(refs.indptr) > 0]] = False
+    rows = np.repeat(np.arange(refs.shape[0]), np.diff(refs.indptr))
+    train = sparse.csr_matrix((refs.data[~held_out], (rows[~held_out], refs.indices[~held_out])), shape=refs.shape)
+    test = sparse.csr_matrix((refs.data[held_out], (rows[held_out], refs.indices[held_out])), shape=refs.shape)
+    return train, test
+
+
+def evaluate(train, test, iter_scores, size, liked):
+    """
+    Mean Absolute Error and Coverage of Scores on Held-Out Ratings, and Share of Held-Out Ratings of at Least liked
+    Recommended in Top-size, Given (rows, scores) Blocks of iter_scores.
+    """
+    errors, predicted, hits, total = 0.0, 0, 0, test.nnz
+    for rows, scores in iter_scores:
+        block = test[rows].tocoo()
+        values = scores[block.row, block.col]
+        defined = np.isfinite(values)
+        errors += np.abs(values[defined] - block.data[defined]).sum()
+        predicted += np.count_nonzero(defined)
+        recommend_indexes, _ = select(scores, train, rows, size)
+        liked_rows, liked_cols = block.row[block.data >= liked], block.col[block.data >= liked]
+        hits += np.count_nonzero((recommend_indexes[liked_rows] == liked_cols[:, None]).any(axis=1))
+    return errors / max(predicted, 1), predicted / max(total, 1), hits / max(np.count_nonzero(test.data >= liked), 1)
+
+
+def iter_blocks(rows_count, block_size):
+    for start in range(0, rows_count, block_size):
+        yield slice(start, min(start + block_size, rows_count))
+
+
+def benchmark_recommendation(refs, holdout, authors_size, animes_size, min_co_raters, ranks, size, liked, block_size):
+    train, test = split_ratings(refs, holdout)
+    logger.info('%s Ratings Held Out, %s Liked (At Least %s).' % (test.nnz, np.count_nonzero(test.data >= liked),
+                                                                   liked))
+
+    popularity = np.diff(train.tocsc().indptr).astype('float64')
+    result = evaluate(train, test, ((rows, np.tile(popularity, (rows.stop - rows.start, 1)))
+                                    for rows in iter_blocks(refs.shape[0], block_size)), size, liked)
+    logger.info('Popularity Baseline: Hit Rate@%s %.4f.' % (size, result[2]))
+
+    start = time.perf_counter()
+    indexes, similarities = get_exact_top_matches(train, authors_size, block_size)
+    result = evaluate(train, test, ((rows, weighted_scores(train, rows, indexes[rows], similarities[rows]))
+                                    for rows in iter_blocks(refs.shape[0], block_size)), size, liked)
+    logger.info('User-Based with %s Authors Top-Matches: %.3fs, MAE %.4f, Coverage %.4f, Hit Rate@%s %.4f.'
+                % ((authors_size, time.perf_counter() - start) + result[:2] + (size, result[2])))
+
+    start = time.perf_counter()
+    animes_similarities = masked_pearson(train.tocsc())
+    np.fill_diagonal(animes_similarities, UNDEFINED_SIMILARITY)
+    neighbours = neighbours_matrix(*top_neighbours(train, animes_similarities, animes_size, min_co_raters, block_size))
+    result = evaluate(train, test, ((rows, item_scores(train, rows, neighbours))
+                                    for rows in iter_blocks(refs.shape[0], block_size)), size, liked)
+    logger.info('Item-Based with %s Animes Top-Matches of %s Co-Raters: %.3fs, MAE %.4f, Coverage %.4f, '
+                'Hit Rate@%s %.4f.' % ((animes_size, min_co_raters, time.perf_counter() - start) + result[:2] +
+                                       (size, result[2])))
+
+    for rank in ranks:
+        start = time.perf_counter()
+        mean, authors_factors, animes_factors = factorize(train, rank, 8, 0.1, block_size ** 2 // rank, seed=0)
+        result = evaluate(train, test, ((rows, mean + authors_factors[rows] @ animes_factors.T)
+                                        for rows in iter_blocks(refs.shape[0], block_size)), size, liked)
+        logger.info('Factorization of Rank %s: %.3fs, MAE %.4f, Coverage %.4f, Hit Rate@%s %.4f.'
+                    % ((rank, time.perf_counter() - start) + result[:2] + (size, result[2])))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark Analyzing Modes on Synthetic Ratings.')
+    parser.add_argument('--authors', type=int, default=20000)
+    parser.add_argument('--animes', type=int, default=2000)
+    parser.add_argument('--density', type=float, default=0.02)
+    parser.add_argument('--top', type=int, default=8)
+    parser.add_argument('--lists', type=int, nargs='+', default=[32, 64])
+    parser.add_argument('--probes', type=int, nargs='+', default=[2, 4, 8])
+    parser.add_argument('--block-size', type=int, default=2048)
+    parser.add_argument('--holdout', type=float, default=0.2)
+    parser.add_argument('--neighbours', type=int, default=32)
+    parser.add_argument('--min-co-raters', type=int, default=20)
+    parser.add_argument('--ranks', type=int, nargs='+', default=[16, 32])
+    parser.add_argument('--recommendation-size', type=int, default=8)
+    parser.add_argument('--liked', type=int, default=8)
+    parser.add_argument('--benchmarks', nargs='+', choices=['ann', 'recommendation'], default=['ann', 'recommendation'])
+    args = parser.parse_args()
+
+    refs = make_ratings(args.authors, args.animes, args.density)
+    logger.info('Synthetic Refs Matrix %s Made, with %s Ratings.' % (refs.shape, refs.nnz))
+
+    if 'ann' in args.benchmarks:
+        start = time.perf_counter()
+        pearson_indexes, _ = get_exact_top_matches(refs, args.top, args.block_size)
+        logger.info('Exact Pearson Top-%s of %s Authors: %.3fs.'
+                    % (args.top, refs.shape[0], time.perf_counter() - start))
+        start = time.perf_counter()
+        cosine_indexes, cosine_similarities = get_cosine_top_matches(refs, args.top, args.block_size)
+        logger.info('Exact Cosine Top-%s of %s Authors: %.3fs, Overlap with Pearson %.4f.' % (
+            args.top, refs.shape[0], time.perf_counter() - start, get_overlap(pearson_indexes, cosine_indexes)))
+        for lists in args.lists:
+            for probes in args.probes:
+                benchmark_ann(refs, cosine_similarities, pearson_indexes, args.top, lists, probes, args.block_size)
+    if 'recommendation' in args.benchmarks:
+        benchmark_recommendation(refs, args.holdout, args.top, args.neighbours, args.min_co_raters, args.ranks,
+                                 args.recommendation_size, args.liked, args.block_size)
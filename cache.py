@@ -0,0 +1,115 @@
+import numpy as np
+
+# Multiplier of Fibonacci Hashing, Spreading Packed Keys Evenly Over Buckets.
+_HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+
+class SimilarityCache:
+    """
+    Similarities Between Rows of Refs Matrix, Looked Up and Stored a Whole Row at a Time. A Pair is the Same
+    Whichever Side It is Asked from. Hits and Misses are Counted for report().
+    """
+
+    def __init__(self) -> None:
+        self.hits = 0
+        self.misses = 0
+
+    def get_row(self, row, cols):
+        """
+        Cached Similarities Between row and Every Index of cols, NaN for Those Missing.
+        """
+        values = self.get(row, np.asarray(cols, dtype='int64'))
+        missing = np.count_nonzero(np.isnan(values))
+        self.hits += len(values) - missing
+        self.misses += missing
+        return values
+
+    def set_row(self, row, cols, values) -> None:
+        self.set(row, np.asarray(cols, dtype='int64'), np.asarray(values, dtype='float64'))
+
+    def get(self, row, cols):
+        pass
+
+    def set(self, row, cols, values) -> None:
+        pass
+
+    def report(self):
+        total = self.hits + self.misses
+        return '%s Hits, %s Misses, %.2f%% Hit Rate' % (self.hits, self.misses, 100 * self.hits / max(total, 1))
+
+
+class LocalSimilarityCache(SimilarityCache):
+    """
+    In-Process Set-Associative Cache of at Most About size Pairs. A Pair is Packed Into One int64 Key and Hashed to
+    a Bucket of ways Slots, the Least Recently Used Slot of Which is Replaced. Keys, Values and Use Stamps are Kept in
+    Flat NumPy Arrays, About 20 Bytes per Pair, and Whole Rows are Looked Up Vectorized.
+    """
+
+    def __init__(self, size, ways=8) -> None:
+        super().__init__()
+        self.ways = ways
+        self.bits = max(1, int(np.ceil(np.log2(max(size, ways) / ways))))
+        self.keys = np.full((1 << self.bits, ways), -1, dtype='int64')
+        self.values = np.zeros((1 << self.bits, ways), dtype='float32')
+        self.stamps = np.zeros((1 << self.bits, ways), dtype='int64')
+        self.clock = 0
+
+    @staticmethod
+    def pack(row, cols):
+        lhs, rhs = np.minimum(row, cols), np.maximum(row, cols)
+        return (lhs << 32) | rhs
+
+    def get_buckets(self, keys):
+        return ((keys.astype('uint64') * _HASH_MULTIPLIER) >> np.uint64(64 - self.bits)).astype('int64')
+
+    def get(self, row, cols):
+        keys = self.pack(row, cols)
+        buckets = self.get_buckets(keys)
+        matched = self.keys[buckets] == keys[:, None]
+        found = matched.any(axis=1)
+        ways = matched.argmax(axis=1)
+        values = np.full(len(keys), np.nan)
+        values[found] = self.values[buckets[found], ways[found]]
+        self.clock += 1
+        self.stamps[buckets[found], ways[found]] = self.clock
+        return values
+
+    def set(self, row, cols, values) -> None:
+        keys = self.pack(row, cols)
+        buckets = self.get_buckets(keys)
+        matched = self.keys[buckets] == keys[:, None]
+        ways = np.where(matched.any(axis=1), matched.argmax(axis=1), self.stamps[buckets].argmin(axis=1))
+        self.clock += 1
+        # Pairs Falling Into the Same Bucket in One Call Overwrite Each Other, Which Only Costs a Later Miss.
+        self.keys[buckets, ways] = keys
+        self.values[buckets, ways] = values
+        self.stamps[buckets, ways] = self.clock
+
+
+class RedisSimilarityCache(SimilarityCache):
+    """
+    Similarities Kept in Redis as 'lhs_mid:rhs_mid' Keys Expiring After ttl (Second), so They are Shared Between
+    Runs. A Row is Read by a Single MGET and Written by a Single Pipeline, Rather than a Round Trip per Pair.
+    Eviction is Left to the Server, Which Should be Configured with an LRU maxmemory-policy.
+    """
+
+    def __init__(self, redis, ids, ttl) -> None:
+        super().__init__()
+        self.redis = redis
+        self.ids = ids
+        self.ttl = ttl
+
+    def get_keys(self, row, cols):
+        return ['%s:%s' % (self.ids[min(row, col)], self.ids[max(row, col)]) for col in cols]
+
+    def get(self, row, cols):
+        if len(cols) == 0:
+            return np.empty(0)
+        return np.array([np.nan if value is None else float(value)
+                         for value in self.redis.mget(self.get_keys(row, cols))])
+
+    def set(self, row, cols, values) -> None:
+        pipeline = self.redis.pipeline(transaction=False)
+        for key, value in zip(self.get_keys(row, cols), values):
+            pipeline.set(key, float(value), ex=self.ttl)
+        pipeline.execute()
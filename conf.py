@@ -1,3 +1,4 @@
+import json
 import os
 
 
@@ -16,15 +17,21 @@ class Conf:
     DB_USERNAME = os.environ.get('DB_USERNAME', 'bangumi')
     DB_PASSWORD = os.environ.get('DB_PASSWORD', 'password')
 
+    # Write Operations Buffered Will be Flushed in Bulk When Size or Interval (Second) Reached.
+    DB_BULK_SIZE = int(os.environ.get('DB_BULK_SIZE', 1000))
+    DB_BULK_INTERVAL = float(os.environ.get('DB_BULK_INTERVAL', 5))
+
     # Cache Backend
     REDIS_HOST = os.environ.get('REDIS_HOST', 'localhost')
     REDIS_PORT = int(os.environ.get('REDIS_PORT', 6379))
     REDIS_DATABASE = int(os.environ.get('REDIS_DATABASE', 0))
     REDIS_PASSWORD = os.environ.get('REDIS_PASSWORD', None)
-    REDIS_MAX_MEMORY = '%smb' % int(os.environ.get('REDIS_MAX_MEMORY', 1024))
 
     REDIS_SIMILARITY_TTL = int(os.environ.get('REDIS_KV_TTL', 86400))
 
+    # Checkpoints of Pipeline Stages, an Interrupted Run Will be Resumed from Them.
+    PIPELINE_CHECKPOINT_FILENAME = os.environ.get('PIPELINE_CHECKPOINT_FILENAME', 'pipeline.db')
+
     # Logging
     LOGGING_FILENAME = os.environ.get('LOGGING_FILENAME', 'stdout.log')
     LOGGING_MAX_BYTES = int(os.environ.get('LOGGING_MAX_BYTES', 65536))
@@ -33,6 +40,32 @@ class Conf:
     # Crawler
     CRAWL_MAX_RETRY = int(os.environ.get('CRAWL_MAX_RETRY', 32))
 
+    # Keep-Alive Connections Pooled per Host, Idle Ones are Closed After Timeout (Second).
+    CRAWL_POOL_SIZE = int(os.environ.get('CRAWL_POOL_SIZE', 16))
+    CRAWL_KEEPALIVE_TIMEOUT = int(os.environ.get('CRAWL_KEEPALIVE_TIMEOUT', 60))
+    # Concurrent Requests of a Single Endpoint at Most.
+    CRAWL_CONCURRENCY_PER_ENDPOINT = int(os.environ.get('CRAWL_CONCURRENCY_PER_ENDPOINT', 16))
+    # ETag / Last-Modified Validators and Parsed Responses of Conditional Requests.
+    CRAWL_VALIDATORS_FILENAME = os.environ.get('CRAWL_VALIDATORS_FILENAME', 'validators.db')
+    # Timeout of a Single Request (Second).
+    CRAWL_TIMEOUT = int(os.environ.get('CRAWL_TIMEOUT', 30))
+
+    # Requests per Second of Every Endpoint (index, season, reviews, follow, auth), Overridden by a JSON Object of
+    # Endpoint to Rate, and Requests Allowed in a Burst.
+    CRAWL_RATE = float(os.environ.get('CRAWL_RATE', 16))
+    CRAWL_RATES = json.loads(os.environ.get('CRAWL_RATES', '{"auth": 1}'))
+    CRAWL_BURST = int(os.environ.get('CRAWL_BURST', 16))
+    # Attempts of a Single Request, Throttled or Failed Ones are Retried with Exponential Backoff (Second).
+    CRAWL_REQUEST_RETRY = int(os.environ.get('CRAWL_REQUEST_RETRY', 4))
+    CRAWL_BACKOFF_BASE = float(os.environ.get('CRAWL_BACKOFF_BASE', 0.5))
+    CRAWL_BACKOFF_MAX = float(os.environ.get('CRAWL_BACKOFF_MAX', 60))
+    # Responses Slower than Threshold (Second) Make Concurrency of Its Endpoint Back Off Like Throttled Ones.
+    CRAWL_LATENCY_THRESHOLD = float(os.environ.get('CRAWL_LATENCY_THRESHOLD', 5))
+
+    # Pages of Reviews Got but Not Persisted Yet, and Pages Persisted Together at Most.
+    CRAWL_REVIEWS_QUEUE_SIZE = int(os.environ.get('CRAWL_REVIEWS_QUEUE_SIZE', 256))
+    CRAWL_REVIEWS_BATCH_SIZE = int(os.environ.get('CRAWL_REVIEWS_BATCH_SIZE', 32))
+
     # eg. 0 - 全部, 1 - 正片, 3 - 剧场版, 4 - 其他
     CRAWL_VERSION = int(os.environ.get('CRAW_VERSION', 0))
     # eg. 0 - 全部, 2 - 日本, 3 - 美国, 4 - 其他
@@ -60,13 +93,69 @@ class Conf:
     ANALYZE_AUTHOR_TOP_MATCHES_SIZE = int(os.environ.get('ANALYZE_AUTHOR_TOP_MATCHES_SIZE', 8))
     ANALYZE_AUTHOR_RECOMMENDATION_SIZE = int(os.environ.get('ANALYZE_AUTHOR_RECOMMENDATION_SIZE', 8))
 
+    # Authors Recommendation Will be Made from Similar Authors ('user'), or from Up to ANALYZE_ITEM_NEIGHBOURS_SIZE
+    # Top-Matches of Every Anime Among Those the Author Rated ('item'), Which Needs No Authors Similarities and
+    # Leaves Authors Top-Matches as They Were. Only Animes Rated Together by at Least ANALYZE_ITEM_MIN_CO_RATERS
+    # Authors are Neighbours. 'item' is Experimental, It Still Ranks Far Worse than 'user' and Even Popularity, See
+    # benchmark.py for Accuracy of Both on Held-Out Ratings.
+    ANALYZE_AUTHOR_RECOMMENDATION_MODE = os.environ.get('ANALYZE_AUTHOR_RECOMMENDATION_MODE', 'user')
+    ANALYZE_ITEM_NEIGHBOURS_SIZE = int(os.environ.get('ANALYZE_ITEM_NEIGHBOURS_SIZE', 32))
+    ANALYZE_ITEM_MIN_CO_RATERS = int(os.environ.get('ANALYZE_ITEM_MIN_CO_RATERS', 20))
+
+    # Analyzing Engine, 'neighbourhood' (Similar Authors or Animes) or 'factorization' (Embeddings of Authors and
+    # Animes Trained by Alternating Least Squares, Which Scales Linearly with Ratings). 'factorization' is
+    # Experimental, It Predicts Ratings Well but Ranks Far Worse than 'neighbourhood' and Even Popularity, See
+    # benchmark.py for Accuracy on Held-Out Ratings.
+    ANALYZE_ENGINE = os.environ.get('ANALYZE_ENGINE', 'neighbourhood')
+    # Embeddings of Rank Dimensions are Trained by Iterations from Scratch, or Warm Started from the Stored Ones by
+    # Warm Iterations, Regularization is Scaled by Ratings of Every Author and Anime.
+    ANALYZE_FACTORIZATION_RANK = int(os.environ.get('ANALYZE_FACTORIZATION_RANK', 16))
+    ANALYZE_FACTORIZATION_ITERATIONS = int(os.environ.get('ANALYZE_FACTORIZATION_ITERATIONS', 8))
+    ANALYZE_FACTORIZATION_WARM_ITERATIONS = int(os.environ.get('ANALYZE_FACTORIZATION_WARM_ITERATIONS', 2))
+    ANALYZE_FACTORIZATION_REGULARIZATION = float(os.environ.get('ANALYZE_FACTORIZATION_REGULARIZATION', 0.1))
+
     # Author Whose Reviews More than Threshold Will be Calculate.
     ANALYZE_AUTHOR_REVIEWS_VALID_THRESHOLD = int(os.environ.get('ANALYZE_AUTHOR_REVIEWS_VALID_THRESHOLD', 8))
 
     ANALYZE_AUTHOR_TTL = int(os.environ.get('ANALYZE_AUTHOR_TTL', 512))
 
-    # HDF5 File
-    HDF5_FILENAME = os.environ.get('HDF5_FILENAME', 'bangumi.hdf5')
+    # Authors Similarity Matrix Will be Calculated Tile by Tile and Written to HDF5 File Rather than Kept in
+    # Memory, Peak Memory is Bounded by Block Size (Authors per Tile Side).
+    ANALYZE_AUTHOR_BLOCKED_ENABLE = True if os.environ.get('ANALYZE_AUTHOR_BLOCKED_ENABLE',
+                                                           'True').lower() == 'true' else False
+    ANALYZE_BLOCK_SIZE = int(os.environ.get('ANALYZE_BLOCK_SIZE', 2048))
+
+    # Similarity Tiles and Recommendation Blocks Will be Calculated by a Process Pool If More than 1 Worker.
+    ANALYZE_WORKERS = int(os.environ.get('ANALYZE_WORKERS', os.cpu_count() or 1))
+
+    # Refs Matrix Will be Patched with Rows of Authors Changed Since Last Build Rather than Rebuilt from Scratch.
+    ANALYZE_REFS_INCREMENTAL_ENABLE = True if os.environ.get('ANALYZE_REFS_INCREMENTAL_ENABLE',
+                                                             'True').lower() == 'true' else False
+
+    # Stored Similarities are Updated Only for Rows and Columns Whose Ratings Changed, Unless Ratio of Them
+    # Exceeds This, When Calculating from Scratch is Cheaper. Blocked Ones are Also Calculated from Scratch If Those
+    # Changed are Scattered Over So Many Tiles that Rewriting Them Costs More.
+    ANALYZE_SIMILARITY_INCREMENTAL_RATIO = float(os.environ.get('ANALYZE_SIMILARITY_INCREMENTAL_RATIO', 0.25))
+
+    # Authors Top-Matches Will be Approximated by an Inverted File Index, Every Author is Compared Only with Those
+    # in ANALYZE_ANN_PROBES of ANALYZE_ANN_LISTS Clusters Closest to It. Similarity is Then Centred Cosine Rather
+    # than Co-Rated Pearson, so Top-Matches are Not an Approximation of Those of the Exact Path: Recall Reported by
+    # benchmark.py is Against Exact Centred Cosine, While Even Exact Cosine Top-Matches Share Only About 2% with
+    # Pearson Ones on Synthetic Ratings.
+    ANALYZE_AUTHOR_ANN_ENABLE = True if os.environ.get('ANALYZE_AUTHOR_ANN_ENABLE',
+                                                       'False').lower() == 'true' else False
+    ANALYZE_ANN_LISTS = int(os.environ.get('ANALYZE_ANN_LISTS', 64))
+    ANALYZE_ANN_PROBES = int(os.environ.get('ANALYZE_ANN_PROBES', 8))
+
+    # If Similarity Matrix Does Not Fit in Memory, Similarities are Calculated Row by Row and Cached in Process
+    # ('local', at Most About ANALYZE_SIMILARITY_CACHE_SIZE Pairs) or in Redis ('redis', Shared Between Runs).
+    ANALYZE_SIMILARITY_CACHE = os.environ.get('ANALYZE_SIMILARITY_CACHE', 'local')
+    ANALYZE_SIMILARITY_CACHE_SIZE = int(os.environ.get('ANALYZE_SIMILARITY_CACHE_SIZE', 1 << 24))
+
+    # HDF5 Files, One per Matrix, Under This Directory.
+    HDF5_DIRECTORY = os.environ.get('HDF5_DIRECTORY', 'hdf5')
+    # Similarity Matrices Not Resizable Will be Written Uncompressed and Read by Memory Mapping Rather than Slicing.
+    HDF5_MEMMAP_ENABLE = True if os.environ.get('HDF5_MEMMAP_ENABLE', 'False').lower() == 'true' else False
     # Matrix in HDF5 File Will Be Re-Use If It Not Expired (Hour) Rather than Re-Calculate.
     HDF5_DATA_SET_TTL = int(os.environ.get('HDF5_DATA_SET_TTL', 64))
 
@@ -1,11 +1,12 @@
+import asyncio
 import gc
+import hashlib
 import json
 from datetime import datetime, timedelta
 from json import JSONDecodeError
 
-import requests
-from requests.exceptions import RequestException
-
+from fetcher import Fetcher, FetchError
+from pipeline import Stage
 from utils import logger, log_duration
 
 
@@ -18,6 +19,11 @@ class BangumiCrawler:
         'X-Requested-With': 'XMLHttpRequest'
     }
 
+    # Overridable to Replay Against a Local Stub Server.
+    BANGUMI_URL = 'https://bangumi.bilibili.com'
+    SPACE_URL = 'https://space.bilibili.com'
+    AUTH_URL = 'https://api.kaaass.net'
+
     def __init__(self, db, conf) -> None:
         self.conf = conf
         self.db = db
@@ -25,15 +31,20 @@ class BangumiCrawler:
             'done': False,
             'last_update': datetime.now()
         }
+        self.fetcher = None
+        self.auth_lock = None
+
+    @staticmethod
+    def parse_detail(detail_text):
+        return json.loads(detail_text[19:-2])['result']
 
     @staticmethod
-    def make_anime(detail_response, raw_result):
+    def make_anime(detail, raw_result):
         season_id = int(raw_result['season_id'])
         try:
-            detail = json.loads(detail_response.text[19:-2])['result']
             media = detail['media']
-        except (JSONDecodeError, KeyError):
-            logger.warning('Could Not Decode %s.' % detail_response.text)
+        except KeyError:
+            logger.warning('Could Not Decode %s.' % detail)
             return None
         result = {
             'season_id': season_id,
@@ -87,89 +98,180 @@ class BangumiCrawler:
             result.update({'last_ep_index': review['user_season']['last_ep_index']})
         return result
 
-    def auth(self, username=None, password=None):
-        if self.auth_status['done'] and self.auth_status['last_update'] > datetime.now() - timedelta(seconds=180):
-            return False
-        else:
-            username = username or self.conf.CRAWL_USERNAME
-            password = password or self.conf.CRAWL_PASSWORD
-            try:
-                if ('access_key' not in self.auth_status) or \
-                        (self.auth_status['last_update'] < datetime.now() - timedelta(days=7)):
-                    self.auth_status['access_key'] = requests.post('https://api.kaaass.net/biliapi/user/login', data={
-                        'user': username, 'passwd': password
-                    }).json()['access_key']
-
-                response = requests.get('https://api.kaaass.net/biliapi/user/sso?access_key=%s' %
-                                        self.auth_status['access_key']).json()
-                if response['status'] == 'OK':
-                    self.HEADERS.update({'Cookie': response['cookie']})
-                    return True
-            except (RequestException, JSONDecodeError, KeyError):
+    async def auth(self, username=None, password=None):
+        async with self.auth_lock:
+            if self.auth_status['done'] and self.auth_status['last_update'] > datetime.now() - timedelta(seconds=180):
                 return False
+            else:
+                username = username or self.conf.CRAWL_USERNAME
+                password = password or self.conf.CRAWL_PASSWORD
+                try:
+                    if ('access_key' not in self.auth_status) or \
+                            (self.auth_status['last_update'] < datetime.now() - timedelta(days=7)):
+                        self.auth_status['access_key'] = (await self.fetcher.post_json(
+                            'auth', '%s/biliapi/user/login' % self.AUTH_URL, data={'user': username, 'passwd': password}
+                        ))['access_key']
 
-    def crawl_and_persist_reviews(self, media_id, cursor, is_long=True):
+                    response = await self.fetcher.get_json('auth', '%s/biliapi/user/sso?access_key=%s' %
+                                                           (self.AUTH_URL, self.auth_status['access_key']))
+                    if response['status'] == 'OK':
+                        self.HEADERS.update({'Cookie': response['cookie']})
+                        return True
+                except (FetchError, JSONDecodeError, KeyError):
+                    return False
+
+    async def crawl_reviews(self, media_id, cursor, queue, is_long=True):
+        """
+        Produce Pages of Reviews to queue, Next Page is Requested Without Waiting for Previous One Persisted.
+        """
         reviews_type = 'long' if is_long else 'short'
         logger.info("Getting %s's %s Reviews..." % (media_id, reviews_type))
-        url = 'https://bangumi.bilibili.com/review/web_api/%s/list?media_id=%s' % (reviews_type, media_id)
-        response = requests.get('%s&cursor=%s' % (url, cursor) if cursor is not None else url, headers=self.HEADERS)
-        result = response.json()['result']
+        url = '%s/review/web_api/%s/list?media_id=%s' % (self.BANGUMI_URL, reviews_type, media_id)
+        response = await self.fetcher.get_json('reviews', '%s&cursor=%s' % (url, cursor) if cursor is not None else url,
+                                               headers=self.HEADERS)
+        result = response['result']
         total, reviews = result['total'], result['list']
         while len(reviews) > 0:
             try:
                 made_reviews = [self.make_review(review, media_id)
                                 if is_long else self.make_review(review, media_id, is_long=False) for review in reviews]
                 cursor = reviews[-1]['cursor']
-                self.db.persist_reviews(media_id, made_reviews, cursor, is_long=is_long)
+                await queue.put((media_id, made_reviews, cursor, is_long))
                 logger.debug("Processing %s's Reviews at Cursor: %s..." % (media_id, cursor))
-                reviews = requests.get('%s&cursor=%s' % (url, cursor), headers=self.HEADERS).json()['result']['list']
-            except (KeyError, JSONDecodeError, RequestException):
+                reviews = (await self.fetcher.get_json('reviews', '%s&cursor=%s' % (url, cursor),
+                                                       headers=self.HEADERS))['result']['list']
+            except (KeyError, JSONDecodeError, FetchError):
                 logger.warning("Get %s's %s Reviews Broken at Cursor %s." % (media_id, reviews_type.title(), cursor))
-                return False, cursor
+                return False
 
         logger.info("Getting %s's %s Reviews Finished." % (media_id, reviews_type.title()))
-        return True, cursor
+        return True
+
+    async def persist_review_pages(self, queue, committed) -> None:
+        """
+        Consume Pages of Reviews from queue and Persist Them in Batches, Cursor of a Page is Committed Only After
+        It Has Been Written. Stop at None.
+        """
+        loop = asyncio.get_event_loop()
+        is_stopping = False
+        while not is_stopping:
+            batch = []
+            page = await queue.get()
+            while page is not None:
+                batch.append(page)
+                if len(batch) >= self.conf.CRAWL_REVIEWS_BATCH_SIZE or queue.empty():
+                    break
+                page = queue.get_nowait()
+            is_stopping = page is None
+            if len(batch) > 0:
+                await loop.run_in_executor(None, self.db.persist_review_pages, batch)
+                for media_id, _, cursor, is_long in batch:
+                    committed[(media_id, is_long)] = cursor
 
-    def process_animes(self, todo, max_retry):
+    async def process_index(self):
         """
-        Get Detail of Animes and Persist.
+        Get Index of Animes to be Detailed, Pages of Index are Requested Concurrently.
+        """
+
+        logger.info('Getting Animes List...')
+        url = "%s/web_api/season/index_global?version=%s&area=%s&is_finish=%s&start_year=%s&quarter=%s&tag_id=%s" % (
+            self.BANGUMI_URL,
+            self.conf.CRAWL_VERSION,
+            self.conf.CRAWL_AREA,
+            1 if self.conf.CRAWL_IS_FINISH else 0,
+            self.conf.CRAWL_START_YEAR,
+            self.conf.CRAWL_QUARTER,
+            '' if self.conf.CRAWL_TAG_ID == 0 else self.conf.CRAWL_TAG_ID
+        )
+        response = await self.fetcher.get_json('index', url, headers=self.HEADERS)
+        pages = int(response.get("result", {}).get("pages", 0))
+        url += '&page=%s'
+
+        async def get_page(i):
+            attempt = 0
+            while True:
+                try:
+                    response = await self.fetcher.get_json('index', url % i, headers=self.HEADERS)
+                    logger.info('Prepared %s/%s.' % (i, pages))
+                    return response.get('result', {}).get('list', [])
+                except (FetchError, JSONDecodeError):
+                    logger.warning('Get %s Todo Failed, Waiting for Retry...' % i)
+                    await self.fetcher.scheduler.backoff(attempt)
+                    attempt += 1
+
+        todo = []
+        for raw_results in await asyncio.gather(*[get_page(i) for i in range(1, pages + 1)]):
+            todo.extend(raw_results)
+        return todo
+
+    async def process_anime(self, raw_result):
+        season_id = int(raw_result['season_id'])
+        logger.debug('Processing %s...' % season_id)
+        url = '%s/jsonp/seasoninfo/%s.ver?callback=seasonListCallback&jsonp=jsonp' % (self.BANGUMI_URL, season_id)
+        headers = dict(self.HEADERS, Referer='%s/anime/%s' % (self.BANGUMI_URL, season_id))
+        try:
+            # Season Info Rarely Changes, Unchanged Ones are Revalidated Rather than Downloaded and Parsed Again.
+            detail = await self.fetcher.get_conditional('season', url, self.parse_detail, headers=headers)
+        except FetchError:
+            logger.warning("Request %s's API Failed, Waiting for Retry..." % season_id)
+            return None
+        except (JSONDecodeError, KeyError):
+            detail = None
+        result = self.make_anime(detail, raw_result) if detail is not None else None
+        if result is not None:
+            logger.info('%s Processed.' % season_id)
+        else:
+            logger.warning("Decode %s's Response Error, Waiting for Retry..." % season_id)
+        return result
+
+    async def process_animes(self, todo, max_retry, progress=None):
+        """
+        Get Detail of Animes and Persist, Details of All Animes Left are Requested Concurrently Each Try, After Which
+        progress is Called with Those Left If Given.
         """
 
         logger.info('Getting Animes...')
-        url = 'https://bangumi.bilibili.com/jsonp/seasoninfo/%s.ver?callback=seasonListCallback&jsonp=jsonp'
         retry = 0
         while len(todo) > 0 and retry < max_retry:
             logger.info('Start Trying %s Times, %s Animes Left.' % (retry, len(todo)))
-            results = []
-            for raw_result in todo:
-                season_id = int(raw_result['season_id'])
-                logger.debug('Processing %s...' % season_id)
-                try:
-                    detail_response = requests.get(url % season_id, headers={
-                        'Referer': 'https://bangumi.bilibili.com/anime/%s' % season_id
-                    }.update(self.HEADERS))
-                except RequestException:
-                    detail_response = None
-                if detail_response is not None and detail_response.status_code == 200:
-                    result = self.make_anime(detail_response, raw_result)
-                    if result is not None:
-                        results.append(result)
-                        todo.remove(raw_result)
-                        logger.info('%s Processed.' % season_id)
-                    else:
-                        logger.warning("Decode %s's Response Error, Waiting for Retry..." % season_id)
-                        continue
-                else:
-                    logger.warning("Request %s's API Failed, Waiting for Retry..." % season_id)
+            if retry > 0:
+                await self.fetcher.scheduler.backoff(retry)
+            made_results = await asyncio.gather(*[self.process_anime(raw_result) for raw_result in todo])
+            results = [result for result in made_results if result is not None]
+            todo = [raw_result for raw_result, result in zip(todo, made_results) if result is None]
             self.db.persist_animes(results)
+            if progress is not None:
+                progress(todo)
             retry += 1
             logger.info('%s Try Finished, %s Solved, %s Left.' % (retry, len(results), len(todo)))
         logger.info('Getting Detail Finished, with %s Errors.' % len(todo))
         return len(todo), retry
 
-    def process_reviews(self, max_retry):
+    async def process_entrance_reviews(self, entrance, queue):
+        media_id = entrance['media_id']
+        # Both are Awaited Even If One Fails, Otherwise the Other Would Go on Producing Pages Nobody Persists, and
+        # Race with Itself When Retried.
+        results = await asyncio.gather(
+            self.crawl_reviews(media_id, entrance['last_long_reviews_cursor'], queue),
+            self.crawl_reviews(media_id, entrance['last_short_reviews_cursor'], queue, is_long=False),
+            return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException) and not isinstance(result, (KeyError, JSONDecodeError, FetchError)):
+                raise result
+
+        if all(result is True for result in results):
+            logger.info("Get %s's Reviews Finished." % media_id)
+            return True
+        elif any(isinstance(result, BaseException) for result in results):
+            logger.warning("Start Crawl %s's Reviews Failed, Waiting for Retry..." % media_id)
+        else:
+            logger.warning("Get %s's Reviews Partly Finished, Waiting for Retry..." % media_id)
+        return False
+
+    async def process_reviews(self, max_retry):
         """
-        Get reviews of animes
+        Get reviews of animes, Reviews of Different Animes are Requested Concurrently, While Pages Already Got
+        are Persisted in Batches by a Consumer.
         """
 
         logger.info('Getting Reviews...')
@@ -177,113 +279,113 @@ class BangumiCrawler:
         entrances = self.db.get_all_entrances()
         while len(entrances) > 0 and retry < max_retry:
             logger.info('Start Trying %s Times, %s Animes Left.' % (retry, len(entrances)))
+            if retry > 0:
+                await self.fetcher.scheduler.backoff(retry)
+            queue, committed = asyncio.Queue(maxsize=self.conf.CRAWL_REVIEWS_QUEUE_SIZE), {}
+
+            async def produce(entrances):
+                finished = await asyncio.gather(*[self.process_entrance_reviews(entrance, queue)
+                                                  for entrance in entrances])
+                await queue.put(None)
+                return finished
+
+            producer = asyncio.ensure_future(produce(entrances))
+            consumer = asyncio.ensure_future(self.persist_review_pages(queue, committed))
+            # If Either Fails the Other is Cancelled, Otherwise Producers Would Block Forever on a Full Queue
+            # Nobody Consumes, and the Error is Raised with No Cursor of This Try Applied.
+            done, pending = await asyncio.wait([producer, consumer], return_when=asyncio.FIRST_EXCEPTION)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            for task in done:
+                task.result()
+            finished = producer.result()
+
+            # Retry Resumes from the Last Cursor Durably Written.
             for entrance in entrances:
-                media_id = entrance['media_id']
-                try:
-                    is_long_reviews_finished, cursor = self.crawl_and_persist_reviews(
-                        media_id, entrance['last_long_reviews_cursor'])
-                    entrance['last_long_reviews_cursor'] = cursor
-
-                    is_short_reviews_finished, cursor = self.crawl_and_persist_reviews(
-                        media_id, entrance['last_short_reviews_cursor'], is_long=False)
-                    entrance['last_short_reviews_cursor'] = cursor
-
-                    if is_long_reviews_finished and is_short_reviews_finished:
-                        logger.info("Get %s's Reviews Finished." % media_id)
-                        entrances.remove(entrance)
-                    else:
-                        logger.warning("Get %s's Reviews Partly Finished, Waiting for Retry..." % media_id)
-                except (KeyError, JSONDecodeError, RequestException):
-                    logger.warning("Start Crawl %ds's Reviews Failed, Waiting for Retry..." % entrance['media_id'])
+                entrance['last_long_reviews_cursor'] = committed.get(
+                    (entrance['media_id'], True), entrance['last_long_reviews_cursor'])
+                entrance['last_short_reviews_cursor'] = committed.get(
+                    (entrance['media_id'], False), entrance['last_short_reviews_cursor'])
+            entrances = [entrance for entrance, is_finished in zip(entrances, finished) if not is_finished]
             retry += 1
         return len(entrances), retry
 
-    def get_author_follow(self, mid, page_index, max_retry, retry=1):
+    async def get_author_follow(self, mid, page_index, max_retry, retry=1):
         if retry >= max_retry:
             logger.error("Cannot Get %s's Information After Try %s Times." % (mid, retry))
             return 0, []
 
-        url = 'https://space.bilibili.com/ajax/Bangumi/getList?mid=%s' % \
-              (mid if page_index is None else '%s&page=%s' % (mid, page_index))
-        response = requests.get(url, headers=self.HEADERS).json()
+        url = '%s/ajax/Bangumi/getList?mid=%s' % \
+              (self.SPACE_URL, mid if page_index is None else '%s&page=%s' % (mid, page_index))
+        try:
+            response = await self.fetcher.get_json('follow', url, headers=self.HEADERS)
+        except JSONDecodeError as e:
+            raise FetchError("%s's Follow Could Not be Decoded Because %s." % (mid, e))
         if not response['status']:
             if response['data'] == '获取登录数据失败':
                 logger.warning("%s's API Request Failed, Try to Auth..." % mid)
-                if self.auth():
+                if await self.auth():
                     logger.info('Auth Success.')
-                    return self.get_author_follow(mid, page_index, max_retry, retry=retry + 1)
+                    return await self.get_author_follow(mid, page_index, max_retry, retry=retry + 1)
                 else:
                     raise RuntimeError('Auth Failed.')
             elif response['data'] == '用户隐私设置未公开':
                 return 0, []
         return int(response['data']['pages']), response['data']['result']
 
-    def process_authors(self, max_retry):
+    async def process_author(self, mid, max_retry):
+        try:
+            season_ids = []
+            pages, result = await self.get_author_follow(mid, page_index=None, max_retry=max_retry)
+            season_ids.extend([int(i['season_id']) for i in result])
+            for _, result in await asyncio.gather(*[
+                    self.get_author_follow(mid, page_index=page_index, max_retry=max_retry)
+                    for page_index in range(2, pages + 1)]):
+                season_ids.extend([int(i['season_id']) for i in result])
+            self.db.push_to_follow(mid, season_ids)
+            logger.info("Get %s's Follow Finished." % mid)
+            return True
+        except (FetchError, KeyError, RuntimeError) as e:
+            logger.warning("Get %s's Follow Failed, Waiting for Retry...(%s)" % (mid, e))
+            return False
+
+    async def process_authors(self, max_retry):
+        """
+        Get Follow of Authors, Follow of Different Authors are Requested Concurrently.
+        """
+
         logger.info('Getting Authors...')
         tasks = [i['mid'] for i in self.db.get_author_tasks()]
 
         retry = 0
         while len(tasks) > 0 and retry < max_retry:
             logger.info('Start Trying %s Times, %s Authors Left.' % (retry, len(tasks)))
-            for mid in tasks:
-                try:
-                    season_ids = []
-                    pages, result = self.get_author_follow(mid, page_index=None, max_retry=max_retry)
-                    season_ids.extend([int(i['season_id']) for i in result])
-                    for page_index in range(2, pages):
-                        _, result = self.get_author_follow(mid, page_index=page_index, max_retry=max_retry)
-                        season_ids.extend([int(i['season_id']) for i in result])
-                    self.db.push_to_follow(mid, season_ids)
-                    tasks.remove(mid)
-                    logger.info("Get %s's Follow Finished." % mid)
-                except (RequestException, RuntimeError) as e:
-                    logger.warning("Get %s's Follow Failed, Waiting for Retry...(%s)" % (mid, e))
-                    continue
+            if retry > 0:
+                await self.fetcher.scheduler.backoff(retry)
+            finished = await asyncio.gather(*[self.process_author(mid, max_retry) for mid in tasks])
+            tasks = [mid for mid, is_finished in zip(tasks, finished) if not is_finished]
             retry += 1
         return len(tasks), retry
 
-    @log_duration
-    def crawl(self, full_crawl=False, max_retry=None) -> None:
-        logger.info('New Crawl Beginning...')
-
-        # Get all animes
-        logger.info('Getting Animes List...')
-        url = "https://bangumi.bilibili.com/web_api/season/index_global?version=%s&area=%s&is_finish=%s&start_year=%s" \
-              "&quarter=%s&tag_id=%s" % (
-                  self.conf.CRAWL_VERSION,
-                  self.conf.CRAWL_AREA,
-                  1 if self.conf.CRAWL_IS_FINISH else 0,
-                  self.conf.CRAWL_START_YEAR,
-                  self.conf.CRAWL_QUARTER,
-                  '' if self.conf.CRAWL_TAG_ID == 0 else self.conf.ANIMES_TAG_ID
-              )
-        response = requests.get(url, headers=self.HEADERS).json()
-        pages = int(response.get("result", {}).get("pages", 0))
-        url += '&page=%s'
+    async def async_crawl(self, full_crawl=False, max_retry=None) -> None:
+        self.auth_lock = asyncio.Lock()
+        async with Fetcher(self.conf) as self.fetcher:
+            todo = await self.process_index()
 
-        if full_crawl:
-            self.db.truncate_all()
+            if full_crawl:
+                self.db.truncate_all()
 
-        todo = []
-        for i in range(1, pages + 1):
-            logger.info('Preparing %s/%s...' % (i, pages))
-            while True:
-                try:
-                    raw_results = requests.get(url % i, headers=self.HEADERS).json().get('result', {}).get('list', [])
-                    break
-                except RequestException:
-                    logger.warning('Get %s Todo Failed, Waiting for Retry...' % i)
-            for raw_result in raw_results:
-                todo.append(raw_result)
+            max_retry = max_retry or self.conf.CRAWL_MAX_RETRY
+            todo_left, detail_retry = await self.process_animes(todo, max_retry)
+            reviews_left, reviews_retry = await self.process_reviews(max_retry)
 
-        max_retry = max_retry or self.conf.CRAWL_MAX_RETRY
-        todo_left, detail_retry = self.process_animes(todo, max_retry)
-        reviews_left, reviews_retry = self.process_reviews(max_retry)
+            if self.conf.CRAWL_AUTHOR_FOLLOW:
+                authors_left, authors_retry = await self.process_authors(max_retry)
+            else:
+                authors_left = authors_retry = 0
 
-        if self.conf.CRAWL_AUTHOR_FOLLOW:
-            authors_left, authors_retry = self.process_authors(max_retry)
-        else:
-            authors_left = authors_retry = 0
+            self.report_requests()
 
         logger.info('Archiving...')
         self.db.archive()
@@ -291,4 +393,50 @@ class BangumiCrawler:
 
         logger.info('Crawling Tasks Finished, (%s, %s, %s) Left, with (%s, %s, %s) Times Retry.'
                     % (todo_left, reviews_left, authors_left, detail_retry, reviews_retry, authors_retry))
+
+    def report_requests(self) -> None:
+        for line in self.fetcher.scheduler.report():
+            logger.info('Requests of %s' % line)
+
+    async def with_fetcher(self, process, *args):
+        self.auth_lock = asyncio.Lock()
+        async with Fetcher(self.conf) as self.fetcher:
+            result = await process(*args)
+            self.report_requests()
+        return result
+
+    def get_stages(self, max_retry=None):
+        """
+        Crawling Stages of pipeline.Pipeline, Each Requesting with a Fetcher of Its Own. Index is Saved as State of
+        Its Stage and Details Save Animes Left After Every Try, so a Resumed Run Gets Neither of Them Again, While
+        Reviews and Follows Resume by Themselves from Cursors and last_crawl Persisted.
+        """
+        max_retry = max_retry or self.conf.CRAWL_MAX_RETRY
+
+        def index(context):
+            todo = asyncio.run(self.with_fetcher(self.process_index))
+            context.save(todo)
+            return hashlib.sha1(json.dumps(todo, sort_keys=True).encode('utf-8')).hexdigest()
+
+        def details(context):
+            todo = context.state if context.state is not None else context.get_state('index')
+            asyncio.run(self.with_fetcher(self.process_animes, todo, max_retry, context.save))
+
+        def reviews(_):
+            asyncio.run(self.with_fetcher(self.process_reviews, max_retry))
+
+        def follows(_):
+            if self.conf.CRAWL_AUTHOR_FOLLOW:
+                asyncio.run(self.with_fetcher(self.process_authors, max_retry))
+
+        def archive(_):
+            self.db.archive()
+
+        return [Stage('index', index), Stage('details', details), Stage('reviews', reviews),
+                Stage('follows', follows), Stage('archive', archive)]
+
+    @log_duration
+    def crawl(self, full_crawl=False, max_retry=None) -> None:
+        logger.info('New Crawl Beginning...')
+        asyncio.run(self.async_crawl(full_crawl=full_crawl, max_retry=max_retry))
         gc.collect()
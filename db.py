@@ -1,8 +1,9 @@
+import time
 from datetime import date
 from datetime import datetime
 from datetime import timedelta
 
-from pymongo import MongoClient, IndexModel, ASCENDING, DESCENDING
+from pymongo import MongoClient, IndexModel, ASCENDING, DESCENDING, UpdateOne
 
 from utils import logger, log_duration
 
@@ -21,57 +22,97 @@ class DB:
     def persist_reviews(self, media_id, reviews, cursor=None, is_long=True) -> None:
         pass
 
+    def persist_review_pages(self, pages) -> None:
+        pass
+
     def get_all_entrances(self):
         pass
 
     def get_author_tasks(self):
         pass
 
-    def get_author_watched_media_ids(self, mid):
+    def get_valid_author_ratings_follow_pairs(self, since=None):
         pass
 
-    def get_valid_author_ratings_follow_pairs(self):
+    def migrate_embedded_reviews(self) -> None:
         pass
 
-    def get_authors_count(self):
+    def backfill_reviews_count(self) -> None:
         pass
 
-    def get_reviews_count(self, media_id):
+    def index_updated(self) -> None:
         pass
 
     def push_to_follow(self, mid, season_ids) -> None:
         pass
 
-    def is_need_re_calculate(self, mid):
+    def get_recently_analyzed_mids(self):
         pass
 
-    def update_anime_top_matches(self, media_id, top_matches) -> None:
+    def update_animes_top_matches(self, items) -> None:
         pass
 
-    def update_author_recommendation(self, mid, top_matches, recommendation) -> None:
+    def update_authors_recommendation(self, items) -> None:
         pass
 
 
+class BulkWriter:
+    """
+    Buffer Write Operations of a MongoDB Collection and Flush Them with Unordered bulk_write When Size or Interval
+    (Second) Reached. Callers Needing Durability Before Going on Should flush() Explicitly.
+    """
+
+    def __init__(self, collection, size, interval) -> None:
+        self.collection = collection
+        self.size = size
+        self.interval = interval
+        self.operations = []
+        self.last_flush = time.monotonic()
+
+    def add(self, operation) -> None:
+        self.operations.append(operation)
+        if len(self.operations) >= self.size or time.monotonic() - self.last_flush >= self.interval:
+            self.flush()
+
+    def flush(self) -> None:
+        self.last_flush = time.monotonic()
+        if len(self.operations) == 0:
+            return
+        operations, self.operations = self.operations, []
+        start = time.monotonic()
+        self.collection.bulk_write(operations, ordered=False)
+        duration = max(time.monotonic() - start, 1e-6)
+        logger.info('Flushed %s Operations to %s in %.3fs, %.1f Operations/s.'
+                    % (len(operations), self.collection.name, duration, len(operations) / duration))
+
+
 # Persist solution for MongoDB
 class MongoDB(DB):
     def truncate_all(self) -> None:
         self.db.animes.remove({})
         self.db.authors.remove({})
+        self.db.reviews.remove({})
         self.db.archives.remove({})
+        self.media_ids = {}
 
     @log_duration
     def archive(self) -> None:
         today = datetime.combine(date.today(), datetime.min.time())
         if self.db.archives.find_one({'date': today}) is None:
-            outdated = self.db.animes.find()
+            # Reviews of All Animes are Counted by a Single Streaming Aggregation, Then Joined in Memory.
+            reviews_counts = {i['_id']: i['count'] for i in self.db.reviews.aggregate([
+                {'$group': {'_id': '$media_id', 'count': {'$sum': 1}}}
+            ], allowDiskUse=True)}
+            outdated = self.db.animes.find({}, {
+                'season_id': 1, 'media_id': 1, 'favorites': 1, 'danmaku_count': 1, 'rating': 1
+            })
             archives = []
             for anime in outdated:
-                logger.info('Archiving for Season:%s...' % anime['season_id'])
                 archive = {
                     'season_id': anime['season_id'],
                     'favorites': anime['favorites'],
                     'danmaku_count': anime['danmaku_count'],
-                    'reviews_count': self.get_reviews_count(anime['media_id']),
+                    'reviews_count': reviews_counts.get(anime['media_id'], 0),
                 }
                 if 'rating' in anime:
                     archive.update({'rating': anime['rating']})
@@ -80,20 +121,56 @@ class MongoDB(DB):
                 'date': today,
                 'archives': archives
             })
+            logger.info('%s Animes Archived.' % len(archives))
+
+    def get_bulk_writer(self, collection):
+        return BulkWriter(collection, self.conf.DB_BULK_SIZE, self.conf.DB_BULK_INTERVAL)
 
     def persist_animes(self, animes) -> None:
+        writer = self.get_bulk_writer(self.db.animes)
         for anime in animes:
-            self.db.animes.update_one({'season_id': anime['season_id']}, {'$set': anime}, upsert=True)
+            writer.add(UpdateOne({'season_id': anime['season_id']}, {'$set': anime}, upsert=True))
+        writer.flush()
+        if self.media_ids is not None:
+            self.media_ids.update({anime['season_id']: anime['media_id'] for anime in animes})
 
     def persist_reviews(self, media_id, reviews, cursor=None, is_long=True) -> None:
-        for review in reviews:
-            author = review.pop('author')
-            self.db.authors.update_one({'mid': author['mid']},
-                                       {'$set': author, '$push': {'reviews': review}}, upsert=True)
-        if cursor is not None:
+        self.persist_review_pages([(media_id, reviews, cursor, is_long)])
+
+    def persist_review_pages(self, pages) -> None:
+        """
+        Persist Pages of (media_id, reviews, cursor, is_long), Reviews and Their Authors are Written Before Any
+        Cursor of Them. Reviews are Upserted by review_id into Their Own Collection, so a Retried or Resumed Page
+        Replaces Rather than Duplicates Its Reviews, and reviews_count of Authors Touched is Recomputed Rather than
+        Increased for the Same Reason.
+        """
+        authors = {}
+        writer = self.get_bulk_writer(self.db.reviews)
+        for _, reviews, _, _ in pages:
+            for review in reviews:
+                author = review.pop('author')
+                authors[author['mid']] = author
+                review['mid'] = author['mid']
+                writer.add(UpdateOne({'review_id': review['review_id']}, {'$set': review}, upsert=True))
+        writer.flush()
+
+        reviews_counts = self.count_reviews_by_mid(list(authors.keys()))
+        writer = self.get_bulk_writer(self.db.authors)
+        updated = datetime.now()
+        for mid, author in authors.items():
+            author['reviews_count'] = reviews_counts.get(mid, 0)
+            author['updated'] = updated
+            writer.add(UpdateOne({'mid': mid}, {'$set': author}, upsert=True))
+        writer.flush()
+
+        # Only the Last Cursor of Every Reviews Type of an Anime is Written, Since Unordered Writes of Several Could
+        # Land in Any Order and Move It Back.
+        cursors = {(media_id, is_long): cursor for media_id, _, cursor, is_long in pages if cursor is not None}
+        writer = self.get_bulk_writer(self.db.animes)
+        for (media_id, is_long), cursor in cursors.items():
             reviews_type = 'long' if is_long else 'short'
-            self.db.animes.update_one({'media_id': media_id},
-                                      {'$set': {'last_%s_reviews_cursor' % reviews_type: cursor}})
+            writer.add(UpdateOne({'media_id': media_id}, {'$set': {'last_%s_reviews_cursor' % reviews_type: cursor}}))
+        writer.flush()
 
     def get_all_entrances(self):
         return [{
@@ -109,58 +186,143 @@ class MongoDB(DB):
         }, {'mid': 1}).limit(self.conf.CRAWL_AUTHOR_MAX_PER_TIME)
 
     def get_media_id(self, season_id):
-        return self.db.animes.find_one({'season_id': season_id}, {'media_id': 1})['media_id']
-
-    def get_author_watched_media_ids(self, mid):
-        author = self.db.authors.find_one({'mid': mid})
-        commented = set([review['media_id'] for review in author['reviews']])
-        followed = set([self.get_media_id(season_id) for season_id in author.get('follow', [])])
-        return commented | followed
-
-    def get_valid_author_ratings_follow_pairs(self):
-        return ((author['mid'], [review for review in author['reviews']],
-                 [self.get_media_id(season_id) for season_id in author.get('follow', [])])
-                for author in self.db.authors.find({
-                    '$where': 'this.reviews.length > %s' % self.conf.ANALYZE_AUTHOR_REVIEWS_VALID_THRESHOLD
-                }))
-
-    def get_authors_count(self, is_valid=True):
-        query = {
-            '$where': 'this.reviews.length > %s' % self.conf.ANALYZE_AUTHOR_REVIEWS_VALID_THRESHOLD
-        } if is_valid else {}
-        return self.db.authors.count(query)
-
-    def get_reviews_count(self, media_id):
-        pipeline = [{
-            '$project': {'matched': {'$size': {'$filter': {
-                'input': '$reviews', 'cond': {'$eq': ['$$this.media_id', media_id]}
-            }}}}}, {'$group': {'_id': None, 'matched_size': {'$sum': '$matched'}}}]
-        matched_sizes = self.db.authors.aggregate(pipeline)
-        reviews_count = 0
-        for i in matched_sizes:
-            reviews_count += i['matched_size']
-        return reviews_count
+        """
+        Resolve season_id by a season_id to media_id Mapping Loaded Once with a Single Projected Query and Kept
+        Up to Date by persist_animes, None If the Season is Unknown.
+        """
+        if self.media_ids is None:
+            self.media_ids = {anime['season_id']: anime['media_id'] for anime in self.db.animes.find(
+                {}, {'_id': 0, 'season_id': 1, 'media_id': 1})}
+        return self.media_ids.get(season_id)
+
+    def get_media_ids(self, season_ids):
+        return [media_id for media_id in map(self.get_media_id, season_ids) if media_id is not None]
+
+    def count_reviews_by_mid(self, mids=None):
+        pipeline = [{'$group': {'_id': '$mid', 'count': {'$sum': 1}}}]
+        if mids is not None:
+            pipeline.insert(0, {'$match': {'mid': {'$in': mids}}})
+        return {i['_id']: i['count'] for i in self.db.reviews.aggregate(pipeline, allowDiskUse=True)}
+
+    def get_valid_mids(self, since=None):
+        query = {'reviews_count': {'$gt': self.conf.ANALYZE_AUTHOR_REVIEWS_VALID_THRESHOLD}}
+        if since is not None:
+            query['updated'] = {'$gte': since}
+        return [author['mid'] for author in self.db.authors.find(query, {'_id': 0, 'mid': 1})]
+
+    def get_valid_author_ratings_follow_pairs(self, since=None):
+        """
+        Yield (mid, [(media_id, score), ...], follow_media_ids) of Valid Authors, Only Those Whose Reviews or
+        Follows Changed Since since If Given. Only Fields Needed are Projected and Authors are Queried in Batches.
+        Of Several Reviews to the Same Anime, the Latest Modified One Counts.
+        """
+        mids = self.get_valid_mids(since)
+        for start in range(0, len(mids), self.conf.DB_BULK_SIZE):
+            batch = mids[start:start + self.conf.DB_BULK_SIZE]
+            ratings = {mid: {} for mid in batch}
+            for review in self.db.reviews.find({'mid': {'$in': batch}},
+                                               {'_id': 0, 'mid': 1, 'media_id': 1, 'score': 1, 'mtime': 1}):
+                rating = ratings[review['mid']].get(review['media_id'])
+                if rating is None or rating[1] <= review['mtime']:
+                    ratings[review['mid']][review['media_id']] = (review['score'], review['mtime'])
+            follows = {author['mid']: author.get('follow', [])
+                       for author in self.db.authors.find({'mid': {'$in': batch}}, {'_id': 0, 'mid': 1, 'follow': 1})}
+            for mid in batch:
+                yield (mid, [(media_id, score) for media_id, (score, _) in ratings[mid].items()],
+                       self.get_media_ids(follows.get(mid, [])))
+
+    @log_duration
+    def migrate_embedded_reviews(self) -> None:
+        """
+        Move Reviews Embedded in Authors to the reviews Collection, Authors are Migrated in Batches and Their
+        Arrays are Unset Only After Their Reviews Written, so an Interrupted Migration Could Simply be Re-Run.
+        """
+        reviews_writer, authors_writer = self.get_bulk_writer(self.db.reviews), self.get_bulk_writer(self.db.authors)
+        migrated, mids = 0, []
+        for author in self.db.authors.find({'reviews': {'$exists': True}}, {'mid': 1, 'reviews': 1}):
+            for review in author['reviews']:
+                review['mid'] = author['mid']
+                reviews_writer.add(UpdateOne({'review_id': review['review_id']}, {'$set': review}, upsert=True))
+            mids.append(author['mid'])
+            if len(mids) >= self.conf.DB_BULK_SIZE:
+                reviews_writer.flush()
+                for mid in mids:
+                    authors_writer.add(UpdateOne({'mid': mid}, {'$unset': {'reviews': ''}}))
+                authors_writer.flush()
+                migrated += len(mids)
+                mids = []
+                logger.info('%s Authors Migrated...' % migrated)
+        reviews_writer.flush()
+        for mid in mids:
+            authors_writer.add(UpdateOne({'mid': mid}, {'$unset': {'reviews': ''}}))
+        authors_writer.flush()
+        if 'reviews.media_id_1' in self.db.authors.index_information():
+            self.db.authors.drop_index('reviews.media_id_1')
+        logger.info('Migration Finished, %s Authors Migrated.' % (migrated + len(mids)))
+
+    @log_duration
+    def backfill_reviews_count(self) -> None:
+        """
+        Set reviews_count of Every Author from the reviews Collection and Make Sure It is Indexed.
+        """
+        if 'reviews_count_1' not in self.db.authors.index_information():
+            self.db.authors.create_index([('reviews_count', ASCENDING)])
+        writer = self.get_bulk_writer(self.db.authors)
+        for mid, count in self.count_reviews_by_mid().items():
+            writer.add(UpdateOne({'mid': mid}, {'$set': {'reviews_count': count}}))
+        writer.flush()
+        self.db.authors.update_many({'reviews_count': {'$exists': False}}, {'$set': {'reviews_count': 0}})
+
+    def index_updated(self) -> None:
+        """
+        Make Sure updated of Authors, by Which the Refs Matrix is Patched Incrementally, is Indexed.
+        """
+        if 'updated_1' not in self.db.authors.index_information():
+            self.db.authors.create_index([('updated', ASCENDING)])
 
     def push_to_follow(self, mid, season_ids) -> None:
+        # Author is Marked as Updated Only If Follows Really Changed, Otherwise Every Crawl Would Invalidate Its Row.
+        self.db.authors.update_one({'mid': mid, 'follow': {'$ne': season_ids}}, {'$set': {'updated': datetime.now()}})
         self.db.authors.update_one({'mid': mid}, {'$set': {'follow': season_ids, 'last_crawl': datetime.now()}})
 
-    def is_need_re_calculate(self, mid):
+    def get_recently_analyzed_mids(self):
+        """
+        mids Analyzed Within ANALYZE_AUTHOR_TTL, Prefetched by a Single Query Rather than Checked One by One.
+        """
         threshold = datetime.now() - timedelta(hours=self.conf.ANALYZE_AUTHOR_TTL)
-        last_analyze = self.db.authors.find_one({'mid': mid}).get('last_analyze')
-        return last_analyze is None or last_analyze < threshold
-
-    def update_anime_top_matches(self, media_id, top_matches) -> None:
-        self.db.animes.update_one({'media_id': media_id}, {'$set': {'top_matches': top_matches}})
-
-    def update_author_recommendation(self, mid, top_matches, recommendation) -> None:
-        self.db.authors.update_one({'mid': mid}, {'$set': {
-            'top_matches': top_matches,
-            'recommendation': recommendation,
-            'last_analyze': datetime.now()
-        }})
+        return set(author['mid'] for author in self.db.authors.find({'last_analyze': {'$gte': threshold}},
+                                                                     {'_id': 0, 'mid': 1}))
+
+    def update_animes_top_matches(self, items) -> None:
+        """
+        Write Back (media_id, top_matches) of items in Bulk, items Could be a Generator Consumed While Writing.
+        """
+        writer = self.get_bulk_writer(self.db.animes)
+        try:
+            for media_id, top_matches in items:
+                writer.add(UpdateOne({'media_id': media_id}, {'$set': {'top_matches': top_matches}}))
+        finally:
+            writer.flush()
+
+    def update_authors_recommendation(self, items) -> None:
+        """
+        Write Back (mid, top_matches, recommendation) of items in Bulk, items Could be a Generator Consumed While
+        Writing. top_matches of None are Left as They Were.
+        """
+        writer = self.get_bulk_writer(self.db.authors)
+        try:
+            for mid, top_matches, recommendation in items:
+                fields = {'recommendation': recommendation, 'last_analyze': datetime.now()}
+                if top_matches is not None:
+                    fields['top_matches'] = top_matches
+                writer.add(UpdateOne({'mid': mid}, {'$set': fields}))
+        finally:
+            # Authors Written Before a Failure are Kept, so a Fallback Run Skips Them as Recently Analyzed.
+            writer.flush()
 
     def __init__(self, conf) -> None:
         self.conf = conf
+        self.media_ids = None
         self.client = MongoClient(conf.DB_HOST, conf.DB_PORT)
         self.db = self.client[conf.DB_DATABASE]
         if conf.DB_ENABLE_AUTH:
@@ -174,8 +336,14 @@ class MongoDB(DB):
             self.db.animes.create_indexes([animes_index_0, animes_index_1])
         if 'authors' not in collections:
             authors_index_0 = IndexModel([('mid', ASCENDING)])
-            authors_index_1 = IndexModel([('reviews.media_id', ASCENDING)])
-            self.db.authors.create_indexes([authors_index_0, authors_index_1])
+            authors_index_1 = IndexModel([('reviews_count', ASCENDING)])
+            authors_index_2 = IndexModel([('updated', ASCENDING)])
+            self.db.authors.create_indexes([authors_index_0, authors_index_1, authors_index_2])
+        if 'reviews' not in collections:
+            reviews_index_0 = IndexModel([('review_id', ASCENDING)], unique=True)
+            reviews_index_1 = IndexModel([('mid', ASCENDING), ('media_id', ASCENDING)])
+            reviews_index_2 = IndexModel([('media_id', ASCENDING)])
+            self.db.reviews.create_indexes([reviews_index_0, reviews_index_1, reviews_index_2])
         if 'archives' not in collections:
             self.db.archives.create_index([('date', DESCENDING), ('archives.media_id', ASCENDING)])
 
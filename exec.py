@@ -3,10 +3,11 @@ from datetime import datetime
 
 import schedule
 
-from analyzer import BangumiAnalyzer
+from analyzer import BangumiAnalyzer, FactorizationAnalyzer
 from conf import conf
 from crawler import BangumiCrawler
 from db import MongoDB
+from pipeline import Pipeline
 from utils import logger
 
 if __name__ == '__main__':
@@ -15,11 +16,14 @@ if __name__ == '__main__':
     client = MongoDB(conf)
 
     crawler = BangumiCrawler(client, conf)
-    analyzer = BangumiAnalyzer(client, conf)
+    analyzer = (FactorizationAnalyzer if conf.ANALYZE_ENGINE == 'factorization' else BangumiAnalyzer)(client, conf)
+
+    crawl_stages = crawler.get_stages()
+    pipeline = Pipeline(crawl_stages + analyzer.get_stages(inputs=[stage.name for stage in crawl_stages]),
+                        conf.PIPELINE_CHECKPOINT_FILENAME)
 
     def jobs():
-        crawler.crawl()
-        analyzer.analyze()
+        pipeline.run()
 
     if conf.SCHEDULE_ENABLE:
         logger.info('Running with Schedule Enabled, Tasks Schedule Every Day. Now: %s, Next Schedule: %s.' %
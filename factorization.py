@@ -0,0 +1,87 @@
+import numpy as np
+from scipy import sparse
+
+from similarity import top_k
+
+
+def iter_rows_blocks(ratings, max_ratings):
+    """
+    Yield Slices of Consecutive Rows of CSR ratings Holding About max_ratings Ratings Each, at Least One Row.
+    """
+    rows_count, start = ratings.shape[0], 0
+    while start < rows_count:
+        stop = np.searchsorted(ratings.indptr, ratings.indptr[start] + max_ratings, 'right') - 1
+        stop = min(max(stop, start + 1), rows_count)
+        yield slice(start, stop)
+        start = stop
+
+
+def solve_factors(ratings, fixed, regularization, max_ratings):
+    """
+    Least Squares Factors of Every Row of CSR ratings Given Factors fixed of Its Columns, Regularized by
+    regularization x Ratings of the Row (ALS-WR). Rows of a Block with the Same Number of Ratings are Stacked, so
+    Their Normal Equations are Gathered by One Batched Product and All are Solved Together, Which Needs About
+    max_ratings x rank Floats Besides rank x rank per Row.
+    """
+    rank = fixed.shape[1]
+    factors = np.zeros((ratings.shape[0], rank))
+    identity = np.eye(rank)
+    for rows in iter_rows_blocks(ratings, max_ratings):
+        block = ratings[rows]
+        counts = np.diff(block.indptr)
+        grams = np.empty((block.shape[0], rank, rank))
+        targets = np.zeros((block.shape[0], rank, 1))
+        for count in np.unique(counts):
+            stacked = np.flatnonzero(counts == count)
+            entries = block.indptr[stacked][:, None] + np.arange(count)
+            cols = fixed[block.indices[entries]]
+            grams[stacked] = np.matmul(cols.transpose((0, 2, 1)), cols)
+            targets[stacked] = np.matmul(cols.transpose((0, 2, 1)), block.data[entries][:, :, None])
+        grams += regularization * np.maximum(counts, 1)[:, None, None] * identity
+        factors[rows] = np.linalg.solve(grams, targets)[:, :, 0]
+    return factors
+
+
+def init_factors(count, rank, seed=None):
+    return np.random.RandomState(seed).normal(0, 1 / np.sqrt(rank), (count, rank))
+
+
+def factorize(ratings, rank, iterations, regularization, max_ratings, animes_factors=None, seed=None):
+    """
+    Factorize Sparse Authors x Animes ratings as mean + authors_factors @ animes_factors.T by Alternating Least
+    Squares Over Rated Entries Only, Returned as (mean, authors_factors, animes_factors). Given animes_factors (Warm
+    Start) are Refined Rather than Drawn Randomly, so a Few iterations are Enough When Ratings Changed Little.
+    """
+    ratings = sparse.csr_matrix(ratings, dtype='float64', copy=True)
+    mean = ratings.data.mean() if ratings.nnz > 0 else 0.0
+    ratings.data -= mean
+    transposed = ratings.T.tocsr()
+    if animes_factors is None:
+        animes_factors = init_factors(ratings.shape[1], rank, seed)
+    authors_factors = solve_factors(ratings, animes_factors, regularization, max_ratings)
+    for _ in range(iterations):
+        animes_factors = solve_factors(transposed, authors_factors, regularization, max_ratings)
+        authors_factors = solve_factors(ratings, animes_factors, regularization, max_ratings)
+    return mean, authors_factors, animes_factors
+
+
+def get_error(ratings, mean, authors_factors, animes_factors):
+    """
+    Root Mean Squared Error of Factors Over Rated Entries of ratings.
+    """
+    ratings = sparse.coo_matrix(ratings)
+    predictions = mean + np.sum(authors_factors[ratings.row] * animes_factors[ratings.col], axis=1)
+    return np.sqrt(np.mean((predictions - ratings.data) ** 2)) if ratings.nnz > 0 else 0.0
+
+
+def iter_top_matches(factors, k, block_size):
+    """
+    Yield (rows, indexes, similarities) of Top-k Rows of factors by Cosine, Best First, Block by Block of Rows.
+    """
+    norms = np.linalg.norm(factors, axis=1)
+    normalized = factors / np.where(norms > 0, norms, 1)[:, None]
+    for start in range(0, len(factors), block_size):
+        rows = slice(start, min(start + block_size, len(factors)))
+        block = normalized[rows] @ normalized.T
+        block[np.arange(block.shape[0]), np.arange(rows.start, rows.stop)] = -np.inf
+        yield (rows,) + top_k(block, k)
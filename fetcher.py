@@ -0,0 +1,98 @@
+import asyncio
+import json
+import shelve
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from throttle import Scheduler
+
+
+class FetchError(Exception):
+    pass
+
+
+class Fetcher:
+    """
+    Asynchronous HTTP Client Keeping a Pooled Keep-Alive Session per Host. Every Request Names Its Endpoint and
+    Goes Through the Scheduler of Rate Limits and Backoff. Validators of Conditional Requests are Cached on Disk.
+    """
+
+    def __init__(self, conf) -> None:
+        self.conf = conf
+        self.sessions = {}
+        self.scheduler = None
+        self.validators = None
+
+    async def __aenter__(self):
+        self.scheduler = Scheduler(self.conf)
+        self.validators = shelve.open(self.conf.CRAWL_VALIDATORS_FILENAME)
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        for session in self.sessions.values():
+            await session.close()
+        self.sessions.clear()
+        self.validators.close()
+
+    def get_session(self, url):
+        host = urlsplit(url).netloc
+        if host not in self.sessions:
+            connector = aiohttp.TCPConnector(limit=self.conf.CRAWL_POOL_SIZE,
+                                             keepalive_timeout=self.conf.CRAWL_KEEPALIVE_TIMEOUT)
+            self.sessions[host] = aiohttp.ClientSession(
+                connector=connector, timeout=aiohttp.ClientTimeout(total=self.conf.CRAWL_TIMEOUT))
+        return self.sessions[host]
+
+    async def send(self, method, url, headers=None, data=None):
+        try:
+            async with self.get_session(url).request(method, url, headers=headers, data=data) as response:
+                return response.status, await response.text(), response.headers
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise FetchError('%s %s Failed Because %s.' % (method, url, e or type(e).__name__))
+
+    async def request(self, endpoint, method, url, headers=None, data=None):
+        """
+        Return (status, text, headers) of Response, Raise FetchError If Connection Failed, Timeout or Still
+        Throttled After Retries.
+        """
+        return await self.scheduler.schedule(endpoint, lambda: self.send(method, url, headers=headers, data=data),
+                                             FetchError)
+
+    async def get_text(self, endpoint, url, headers=None):
+        status, text, _ = await self.request(endpoint, 'GET', url, headers=headers)
+        if status != 200:
+            raise FetchError('GET %s Failed with Status %s.' % (url, status))
+        return text
+
+    async def get_json(self, endpoint, url, headers=None):
+        return json.loads(await self.get_text(endpoint, url, headers=headers))
+
+    async def post_json(self, endpoint, url, data, headers=None):
+        status, text, _ = await self.request(endpoint, 'POST', url, headers=headers, data=data)
+        if status != 200:
+            raise FetchError('POST %s Failed with Status %s.' % (url, status))
+        return json.loads(text)
+
+    async def get_conditional(self, endpoint, url, parse, headers=None):
+        """
+        GET url with ETag / Last-Modified Validators of Its Last Response, Return parse(text) of a Modified
+        Response, or the Cached Parsed Value If Server Answers 304 Not Modified.
+        """
+        cached = self.validators.get(url)
+        headers = dict(headers or {})
+        if cached is not None:
+            if cached['etag'] is not None:
+                headers['If-None-Match'] = cached['etag']
+            if cached['last_modified'] is not None:
+                headers['If-Modified-Since'] = cached['last_modified']
+        status, text, response_headers = await self.request(endpoint, 'GET', url, headers=headers)
+        if status == 304 and cached is not None:
+            return cached['value']
+        if status != 200:
+            raise FetchError('GET %s Failed with Status %s.' % (url, status))
+        value = parse(text)
+        etag, last_modified = response_headers.get('ETag'), response_headers.get('Last-Modified')
+        if etag is not None or last_modified is not None:
+            self.validators[url] = {'etag': etag, 'last_modified': last_modified, 'value': value}
+        return value
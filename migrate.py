@@ -0,0 +1,15 @@
+from conf import conf
+from db import MongoDB
+from utils import logger
+
+if __name__ == '__main__':
+    client = MongoDB(conf)
+
+    logger.info('Migrating Reviews Embedded in Authors to Reviews Collection...')
+    client.migrate_embedded_reviews()
+
+    logger.info('Backfilling Reviews Count of Authors...')
+    client.backfill_reviews_count()
+
+    logger.info('Indexing Updated Time of Authors...')
+    client.index_updated()
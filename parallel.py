@@ -0,0 +1,113 @@
+import os
+import shutil
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy import sparse
+
+from recommendation import recommend, recommend_by_items
+from similarity import masked_pearson, UNDEFINED_SIMILARITY
+
+# Shared Matrices Attached by Current Worker Process, by Name.
+_shared = {}
+
+
+def dump_shared(mat, directory) -> None:
+    mat = mat if sparse.isspmatrix_csr(mat) or sparse.isspmatrix_csc(mat) else sparse.csr_matrix(mat)
+    np.save(os.path.join(directory, 'data.npy'), mat.data)
+    np.save(os.path.join(directory, 'indices.npy'), mat.indices)
+    np.save(os.path.join(directory, 'indptr.npy'), mat.indptr)
+    np.save(os.path.join(directory, 'meta.npy'), np.array([mat.format == 'csc', mat.shape[0], mat.shape[1]]))
+
+
+def load_shared(directory):
+    """
+    Rebuild a Sparse Matrix on Top of Memory-Mapped Arrays, so All Processes Share the Same Pages.
+    """
+    is_csc, rows_count, cols_count = np.load(os.path.join(directory, 'meta.npy'))
+    arrays = tuple(np.load(os.path.join(directory, '%s.npy' % name), mmap_mode='r')
+                   for name in ('data', 'indices', 'indptr'))
+    return (sparse.csc_matrix if is_csc else sparse.csr_matrix)(arrays, shape=(rows_count, cols_count), copy=False)
+
+
+def _attach(directory, names) -> None:
+    for name in names:
+        _shared[name] = load_shared(os.path.join(directory, name))
+
+
+def _masked_pearson_tile(name, rows, cols):
+    mat = _shared[name]
+    tile = masked_pearson(mat[:, rows], mat[:, cols])
+    if rows == cols:
+        np.fill_diagonal(tile, UNDEFINED_SIMILARITY)
+    return rows, cols, tile
+
+
+def _recommend(rows, indexes, similarities, size):
+    return (rows,) + recommend(_shared['refs'], _shared['watched'], rows, indexes, similarities, size)
+
+
+def _recommend_by_items(rows, size):
+    return (rows,) + recommend_by_items(_shared['refs'], _shared['watched'], rows, _shared['neighbours'], size)
+
+
+class SharedPool:
+    """
+    Process Pool Whose Workers Share Named Sparse Matrices Zero-Copy Through Memory-Mapped Files Rather than
+    Receiving a Pickled Copy Each.
+    """
+
+    def __init__(self, workers, directory=None, **matrices) -> None:
+        self.shapes = {name: mat.shape for name, mat in matrices.items()}
+        self.directory = tempfile.mkdtemp(prefix='bangumi-shared-', dir=directory)
+        for name, mat in matrices.items():
+            os.mkdir(os.path.join(self.directory, name))
+            dump_shared(mat, os.path.join(self.directory, name))
+        self.executor = ProcessPoolExecutor(workers, initializer=_attach, initargs=(self.directory, list(matrices)))
+        # Results Not Consumed Yet are Bounded, Otherwise a Slow Consumer Would Buffer Every Block.
+        self.window = workers * 2
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.executor.shutdown()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def imap(self, func, iterable):
+        pending = deque()
+        for args in iterable:
+            pending.append(self.executor.submit(func, *args))
+            if len(pending) >= self.window:
+                yield pending.popleft().result()
+        while len(pending) > 0:
+            yield pending.popleft().result()
+
+    def iter_masked_pearson_tiles(self, block_size, name='refs'):
+        """
+        Same as similarity.iter_masked_pearson_tiles Over the Shared Matrix name, with Tiles Calculated by Workers.
+        """
+        cols_count = self.shapes[name][1]
+        blocks = [slice(start, min(start + block_size, cols_count)) for start in range(0, cols_count, block_size)]
+        return self.imap(_masked_pearson_tile, ((name, rows, cols) for i, rows in enumerate(blocks)
+                                                for cols in blocks[i:]))
+
+    def iter_recommendations(self, indexes, similarities, size, block_size):
+        """
+        Yield (rows, indexes, scores) of recommendation.recommend Over Row Blocks of Shared Matrices refs and
+        watched, Calculated by Workers.
+        """
+        rows_count = len(indexes)
+        blocks = [slice(start, min(start + block_size, rows_count)) for start in range(0, rows_count, block_size)]
+        return self.imap(_recommend, ((rows, indexes[rows], similarities[rows], size) for rows in blocks))
+
+    def iter_recommendations_by_items(self, size, block_size):
+        """
+        Yield (rows, indexes, scores) of recommendation.recommend_by_items Over Row Blocks of Shared Matrices refs,
+        watched and neighbours, Calculated by Workers.
+        """
+        rows_count = self.shapes['refs'][0]
+        blocks = [slice(start, min(start + block_size, rows_count)) for start in range(0, rows_count, block_size)]
+        return self.imap(_recommend_by_items, ((rows, size) for rows in blocks))
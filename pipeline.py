@@ -0,0 +1,99 @@
+import shelve
+from datetime import datetime
+
+from utils import logger, log_duration
+
+
+class Stage:
+    """
+    Named Step of a Pipeline. run(context) Does the Work and Returns Its Output Version, None Meaning the Run Id.
+    A Stage with inputs (Names of Earlier Stages) is Skipped If Versions of Them and params are the Same as When It
+    Last Finished, While One Without is Always Run Once per Pipeline Run, Like Those Crawling External Data.
+    """
+
+    def __init__(self, name, run, inputs=(), params=None) -> None:
+        self.name = name
+        self.run = run
+        self.inputs = tuple(inputs)
+        self.params = params
+
+
+class StageContext:
+    """
+    Passed to Stage.run, state is What the Stage Saved Before an Interruption of the Same Pipeline Run, or None.
+    """
+
+    def __init__(self, pipeline, stage, state) -> None:
+        self.pipeline = pipeline
+        self.stage = stage
+        self.state = state
+
+    def save(self, state) -> None:
+        """
+        Persist Progress of the Stage, so an Interrupted Run Resumes from It Rather than from Scratch.
+        """
+        self.state = state
+        self.pipeline.put(self.stage.name, dict(self.pipeline.get(self.stage.name) or {}, state=state))
+
+    def get_state(self, name):
+        """
+        State Saved by Stage name, Which Could be Its Output for Later Stages.
+        """
+        return (self.pipeline.get(name) or {}).get('state')
+
+
+class Pipeline:
+    """
+    Stages Run in Order with a Checkpoint of Every One Kept in a Shelf File. A Run Interrupted is Resumed by the Next
+    One at Its First Unfinished Stage, and a Stage Whose Inputs Have Not Changed Since It Last Finished is Skipped.
+    """
+
+    def __init__(self, stages, filename) -> None:
+        self.stages = stages
+        self.filename = filename
+
+    def get(self, key):
+        with shelve.open(self.filename) as checkpoints:
+            return checkpoints.get(key)
+
+    def put(self, key, value) -> None:
+        with shelve.open(self.filename) as checkpoints:
+            checkpoints[key] = value
+
+    def is_done(self, stage, run_id, inputs):
+        checkpoint = self.get(stage.name)
+        if checkpoint is None or not checkpoint.get('done', False):
+            return False
+        if checkpoint['run'] == run_id:
+            return True
+        return len(stage.inputs) > 0 and checkpoint['inputs'] == inputs and checkpoint['params'] == stage.params
+
+    @log_duration
+    def run(self) -> None:
+        run = self.get('run')
+        if run is None or run['finished']:
+            run = {'id': datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f'), 'finished': False}
+            self.put('run', run)
+            logger.info('New Pipeline Run %s Beginning...' % run['id'])
+        else:
+            logger.info('Resuming Pipeline Run %s...' % run['id'])
+
+        for stage in self.stages:
+            inputs = {name: (self.get(name) or {}).get('version') for name in stage.inputs}
+            if self.is_done(stage, run['id'], inputs):
+                logger.info('Stage %s Skipped, Version %s Kept.' % (stage.name, self.get(stage.name)['version']))
+                continue
+            checkpoint = self.get(stage.name) or {}
+            state = checkpoint.get('state') if checkpoint.get('run') == run['id'] else None
+            self.put(stage.name, dict(checkpoint, run=run['id'], done=False, state=state))
+
+            logger.info('Stage %s Beginning%s...' % (stage.name, '' if state is None else ', Resumed'))
+            version = stage.run(StageContext(self, stage, state))
+            version = run['id'] if version is None else version
+            self.put(stage.name, dict(self.get(stage.name), version=version, inputs=inputs, params=stage.params,
+                                      done=True, finished=datetime.now()))
+            logger.info('Stage %s Finished, Version %s.' % (stage.name, version))
+
+        run['finished'] = True
+        self.put('run', run)
+        logger.info('Pipeline Run %s Finished.' % run['id'])
@@ -0,0 +1,104 @@
+import numpy as np
+from scipy import sparse
+
+from similarity import top_k, UNDEFINED_SIMILARITY
+
+
+def weighted_scores(ref_mat, rows, indexes, similarities):
+    """
+    Similarity-Weighted Average of Top-Matches' Ratings for Every Author in rows.
+
+    indexes and similarities are the top-matches of those authors, one row each, a match pointing to the
+    author itself or to -1 is ignored. Neighbours' ratings are gathered with a single sparse product.
+    """
+    authors = np.arange(rows.start, rows.stop)[:, None]
+    valid = np.logical_and(indexes >= 0, indexes != authors)
+    weights = sparse.csr_matrix((similarities[valid], (np.nonzero(valid)[0], indexes[valid])),
+                                shape=(len(indexes), ref_mat.shape[0]))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.asarray((weights @ ref_mat).toarray() / weights.sum(axis=1))
+
+
+def top_neighbours(ref_mat, similarities, size, min_co_raters, block_size):
+    """
+    Top-size Matches of Every Anime as (indexes, similarities), Best First, Among Animes Rated Together with It by
+    at Least min_co_raters Authors.
+
+    Correlations over only a few shared raters are mostly noise, yet are the likeliest to be extreme, so
+    without the threshold neighbours would mostly be picked by chance. similarities (Animes x Animes, such as
+    an HDF5 data set) is read block_size rows at a time, along with co-rater counts of the same rows.
+    """
+    rated = sparse.csc_matrix(ref_mat, dtype='float64', copy=True)
+    rated.eliminate_zeros()
+    rated.data[:] = 1
+    animes_count = rated.shape[1]
+    size = min(size, animes_count)
+    indexes = np.empty((animes_count, size), dtype='int64')
+    values = np.empty((animes_count, size), dtype='float64')
+    for start in range(0, animes_count, block_size):
+        rows = slice(start, min(start + block_size, animes_count))
+        block = np.array(similarities[rows], dtype='float64')
+        block[(rated[:, rows].T @ rated).toarray() < min_co_raters] = UNDEFINED_SIMILARITY
+        indexes[rows], values[rows] = top_k(block, size)
+    return indexes, values
+
+
+def neighbours_matrix(indexes, similarities):
+    """
+    Sparse Animes x Animes Matrix of Top-Matches, Row i Holding Positive Similarities of Anime i's Neighbours.
+
+    indexes and similarities are top-matches of every anime, one row each, matches pointing to the anime itself
+    or to -1 and those not positively correlated are left out, so the average of item_scores is a proper one.
+    """
+    animes = np.arange(len(indexes))[:, None]
+    valid = np.logical_and(np.logical_and(indexes >= 0, indexes != animes), similarities > 0)
+    return sparse.csr_matrix((similarities[valid], (np.nonzero(valid)[0], indexes[valid])),
+                             shape=(len(indexes), len(indexes)))
+
+
+def item_scores(ref_mat, rows, neighbours):
+    """
+    Similarity-Weighted Average of Every Author's Own Ratings Over Rated Neighbours of Each Anime, for Authors in
+    rows. neighbours is Given by neighbours_matrix, so the Products Cost About Ratings x Top-Matches.
+    """
+    ratings = sparse.csr_matrix(ref_mat[rows], dtype='float64')
+    rated = ratings.copy()
+    rated.data[:] = 1
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.asarray((ratings @ neighbours.T).toarray() / (rated @ neighbours.T).toarray())
+
+
+def select(scores, watched_mat, rows, size):
+    """
+    Top-size Animes of scores as (indexes, scores), Best First.
+
+    Watched animes are masked out with the sparse watched_mat, as are animes whose score is undefined, and
+    slots left without a candidate get index -1.
+    """
+    watched = watched_mat[rows].tocoo()
+    scores[watched.row, watched.col] = -np.inf
+    scores[np.isnan(scores)] = -np.inf
+    recommend_indexes, recommend_scores = top_k(scores, size)
+    recommend_indexes[np.isneginf(recommend_scores)] = -1
+    return recommend_indexes, recommend_scores
+
+
+def recommend(ref_mat, watched_mat, rows, indexes, similarities, size):
+    """
+    Top-size Animes of Every Author in rows by weighted_scores (User-Based) as (indexes, scores), Best First.
+    """
+    return select(weighted_scores(ref_mat, rows, indexes, similarities), watched_mat, rows, size)
+
+
+def recommend_by_items(ref_mat, watched_mat, rows, neighbours, size):
+    """
+    Top-size Animes of Every Author in rows by item_scores (Item-Based) as (indexes, scores), Best First.
+    """
+    return select(item_scores(ref_mat, rows, neighbours), watched_mat, rows, size)
+
+
+def recommend_by_factors(mean, authors_factors, animes_factors, watched_mat, rows, size):
+    """
+    Top-size Animes of Every Author in rows by Ratings Predicted from Factors as (indexes, scores), Best First.
+    """
+    return select(mean + authors_factors[rows] @ animes_factors.T, watched_mat, rows, size)
@@ -0,0 +1,161 @@
+import numpy as np
+from scipy import sparse
+
+# Similarity Assigned to Pairs Whose Correlation is Undefined.
+UNDEFINED_SIMILARITY = -1
+
+
+def _values_and_mask(mat):
+    if sparse.issparse(mat):
+        values = mat.astype('float64')
+        values.eliminate_zeros()
+        mask = values.copy()
+        mask.data[:] = 1
+        return values, mask, values.multiply(values)
+    values = np.asarray(mat, dtype='float64')
+    return values, (values > 0).astype('float64'), values * values
+
+
+def _product(lhs, rhs):
+    result = lhs.T @ rhs
+    return result.toarray() if sparse.issparse(result) else np.asarray(result)
+
+
+def masked_pearson(lhs, rhs=None):
+    """
+    Pearson Correlation Between Every Column of lhs and Every Column of rhs, Computed Over Co-Rated Rows Only.
+
+    A zero entry means "not rated", so for each pair of columns only the rows where both are non-zero are
+    correlated. Pairs with fewer than 2 shared ratings, or whose shared ratings have zero variance on either
+    side, get UNDEFINED_SIMILARITY. The whole matrix is built from masked sums, sums of squares and cross
+    products, so the cost is a handful of matrix multiplies instead of one pearsonr call per pair. Both dense
+    arrays and scipy.sparse matrices are accepted, the result is always a dense array.
+    """
+    lhs_parts = _values_and_mask(lhs)
+    return _pearson(lhs_parts, lhs_parts if rhs is None else _values_and_mask(rhs))
+
+
+def _pearson(lhs_parts, rhs_parts):
+    (lhs, lhs_mask, lhs_sq), (rhs, rhs_mask, rhs_sq) = lhs_parts, rhs_parts
+
+    # Shared Counts, Masked Sums, Masked Sums of Squares and Cross Products of Every Pair.
+    n = _product(lhs_mask, rhs_mask)
+    sum_lhs, sum_rhs = _product(lhs, rhs_mask), _product(lhs_mask, rhs)
+    sum_sq_lhs, sum_sq_rhs = _product(lhs_sq, rhs_mask), _product(lhs_mask, rhs_sq)
+    sum_cross = _product(lhs, rhs)
+
+    # Scaled by n to Keep Everything in Exact Integer Arithmetic for Integer Scores.
+    cov = n * sum_cross - sum_lhs * sum_rhs
+    var = (n * sum_sq_lhs - sum_lhs * sum_lhs) * (n * sum_sq_rhs - sum_rhs * sum_rhs)
+
+    result = np.full(n.shape, UNDEFINED_SIMILARITY, dtype='float64')
+    valid = np.logical_and(n > 1, var > 0)
+    result[valid] = cov[valid] / np.sqrt(var[valid])
+    return np.clip(result, -1, 1, out=result)
+
+
+def _column_blocks(mat, block_size):
+    if sparse.issparse(mat):
+        mat = sparse.csc_matrix(mat)
+    cols_count = mat.shape[1]
+    return mat, [slice(start, min(start + block_size, cols_count)) for start in range(0, cols_count, block_size)]
+
+
+def iter_masked_pearson_tiles(mat, block_size):
+    """
+    Yield (rows, cols, tile) Covering the Upper Triangle of Tiles of the Columns x Columns Similarity Matrix of mat
+    in Row-Major Tile Order, the Rest are Their Transposes Yielded by mirror_tiles.
+
+    Each tile is the masked_pearson of block_size columns against block_size columns, with self-similarity
+    set to UNDEFINED_SIMILARITY, so only one tile is held in memory at a time. The matrix is symmetric, so
+    tiles below the diagonal are never calculated.
+    """
+    mat, blocks = _column_blocks(mat, block_size)
+    parts = [_values_and_mask(mat[:, block]) for block in blocks]
+    for i, (row_block, row_parts) in enumerate(zip(blocks, parts)):
+        for col_block, col_parts in zip(blocks[i:], parts[i:]):
+            tile = _pearson(row_parts, col_parts)
+            if row_block == col_block:
+                np.fill_diagonal(tile, UNDEFINED_SIMILARITY)
+            yield row_block, col_block, tile
+
+
+def iter_masked_pearson_patches(mat, indexes, block_size):
+    """
+    Yield (rows, cols, tile, patched) of Tiles in the Upper Triangle of the Columns x Columns Similarity Matrix of
+    mat Having a Row or Column in indexes, in Row-Major Tile Order, the Rest are Their Transposes Yielded by
+    mirror_tiles. Only Entries Where patched is True are Calculated.
+
+    Similarities of a column only depend on its own entries and those of the other column, so when only a few
+    columns changed, recalculating their rows and columns brings the whole matrix up to date at a cost
+    proportional to the number of changed columns. Like iter_masked_pearson_tiles, only one block_size x
+    block_size tile is held in memory at a time, and tiles without a changed column are skipped, so each is
+    read and written at most once by callers patching a stored matrix.
+    """
+    mat, blocks = _column_blocks(mat, block_size)
+    is_stale = np.zeros(mat.shape[1], dtype='bool')
+    is_stale[np.asarray(indexes, dtype='int64')] = True
+    stales = [np.flatnonzero(is_stale[block]) for block in blocks]
+    parts = [_values_and_mask(mat[:, block]) for block in blocks]
+    stale_parts = [_values_and_mask(mat[:, stale + block.start]) for block, stale in zip(blocks, stales)]
+    for i, (row_block, row_stale, row_parts, row_stale_parts) in enumerate(zip(blocks, stales, parts, stale_parts)):
+        for col_block, col_stale, col_parts, col_stale_parts in zip(blocks[i:], stales[i:], parts[i:],
+                                                                    stale_parts[i:]):
+            if len(row_stale) == 0 and len(col_stale) == 0:
+                continue
+            shape = (row_block.stop - row_block.start, col_block.stop - col_block.start)
+            tile = np.full(shape, UNDEFINED_SIMILARITY, dtype='float64')
+            patched = np.zeros(shape, dtype='bool')
+            if len(row_stale) > 0:
+                tile[row_stale] = _pearson(row_stale_parts, col_parts)
+                patched[row_stale] = True
+            if len(col_stale) > 0:
+                tile[:, col_stale] = _pearson(row_parts, col_stale_parts)
+                patched[:, col_stale] = True
+            if row_block == col_block:
+                np.fill_diagonal(tile, UNDEFINED_SIMILARITY)
+            yield row_block, col_block, tile, patched
+
+
+def mirror_tiles(tiles):
+    """
+    Yield Every (rows, cols, *arrays) of tiles Followed by Its Mirror (cols, rows, *transposed_arrays) Unless on
+    the Diagonal, Completing Tiles of a Symmetric Matrix Yielded Only on and Above It.
+    """
+    for rows, cols, *arrays in tiles:
+        yield (rows, cols, *arrays)
+        if rows != cols:
+            yield (cols, rows, *(array.T for array in arrays))
+
+
+def top_k(mat, k, block_size=None):
+    """
+    Column Indexes and Values of the k Largest Entries of Every Row, Best First.
+
+    Rows are processed block_size at a time with argpartition, and only the k selected entries are sorted,
+    so the cost is O(rows x cols) time and O(rows x k) extra memory. mat may be anything supporting row
+    slicing, such as an HDF5 data set, in which case only one row block is read at a time.
+    """
+    rows_count, cols_count = mat.shape
+    k = min(k, cols_count)
+    block_size = block_size or rows_count
+    indexes = np.empty((rows_count, k), dtype='int64')
+    values = np.empty((rows_count, k), dtype=mat.dtype)
+    for start in range(0, rows_count, block_size):
+        block = np.asarray(mat[start:start + block_size])
+        rows = np.arange(block.shape[0])[:, None]
+        partitioned = np.argpartition(block, cols_count - k, axis=1)[:, cols_count - k:]
+        order = np.argsort(block[rows, partitioned], axis=1)[:, ::-1]
+        indexes[start:start + block_size] = partitioned[rows, order]
+        values[start:start + block_size] = block[rows, indexes[start:start + block_size]]
+    return indexes, values
+
+
+def merge_top_matches(indexes, similarities, tile_indexes, tile_similarities):
+    """
+    Merge a Tile Into Running Top-Matches of the Same Rows, Keeping the Width of indexes, Best First.
+    """
+    candidates_indexes = np.hstack((indexes, np.broadcast_to(tile_indexes, tile_similarities.shape)))
+    candidates_similarities = np.hstack((similarities, tile_similarities))
+    order, top_similarities = top_k(candidates_similarities, indexes.shape[1])
+    return candidates_indexes[np.arange(order.shape[0])[:, None], order], top_similarities
@@ -0,0 +1,122 @@
+import os
+from contextlib import contextmanager
+
+import h5py
+import numpy as np
+from scipy import sparse
+
+# Upper Bound of Uncompressed Bytes per Chunk, Small Enough for HDF5 Chunk Cache.
+CHUNK_BYTES = 1 << 20
+
+
+class LazyMatrix:
+    """
+    Dense Data Set Read Only When Sliced, Every Slice Opens the File Again so Nothing Stays Open Between Reads.
+    """
+
+    def __init__(self, filename, key) -> None:
+        self.filename = filename
+        self.key = key
+        with h5py.File(filename, 'r') as f:
+            self.shape, self.dtype = f[key].shape, f[key].dtype
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def __getitem__(self, item):
+        with h5py.File(self.filename, 'r') as f:
+            return f[self.key][item]
+
+
+class MatrixStore:
+    """
+    Matrices Persisted in an HDF5 File per Name Under directory. A File is Created Under a Temporary Name and
+    Renamed Over the Old One Only After Fully Written, so a Failed Run Never Leaves Another Matrix Destroyed or
+    Half Written. Dense Data Sets are Chunked by Row Blocks of block_size and Compressed, Unless memmap Enabled,
+    When Those Not Resizable are Written Contiguous and Uncompressed to be Memory-Mapped.
+    """
+
+    def __init__(self, directory, block_size, memmap=False) -> None:
+        self.directory = directory
+        self.block_size = block_size
+        self.memmap = memmap
+        os.makedirs(directory, exist_ok=True)
+
+    def get_filename(self, name):
+        return os.path.join(self.directory, '%s.hdf5' % name)
+
+    def exists(self, name):
+        return os.path.exists(self.get_filename(name))
+
+    def open(self, name, mode='r'):
+        """
+        Open Existing File of name, Writes of Mode 'r+' Happen in Place and are Not Atomic.
+        """
+        return h5py.File(self.get_filename(name), mode)
+
+    @contextmanager
+    def create(self, name):
+        """
+        Yield a New File Which Replaces That of name Only If the Block Exits Without Error.
+        """
+        filename = self.get_filename(name)
+        temp_filename = '%s.tmp' % filename
+        try:
+            with h5py.File(temp_filename, 'w') as f:
+                yield f
+            os.replace(temp_filename, filename)
+        finally:
+            if os.path.exists(temp_filename):
+                os.remove(temp_filename)
+
+    def get_chunks(self, shape, dtype):
+        """
+        Chunks of block_size Rows and a Power of 2 Columns Within CHUNK_BYTES, so Reading a Row Block Decompresses
+        Only Chunks Inside It and a Tile of block_size Columns Covers Whole Chunks.
+        """
+        rows = max(1, min(self.block_size, shape[0]))
+        cols = max(1, CHUNK_BYTES // (rows * np.dtype(dtype).itemsize))
+        cols = min(2 ** int(np.log2(cols)), max(1, shape[1]))
+        return rows, cols
+
+    def create_dense(self, f, key, data=None, shape=None, dtype='float64', resizable=False, fillvalue=None):
+        if data is not None:
+            data = np.asarray(data)
+            shape, dtype = data.shape, data.dtype
+        if self.memmap and not resizable:
+            return f.create_dataset(key, data=data, shape=shape, dtype=dtype, fillvalue=fillvalue)
+        return f.create_dataset(key, data=data, shape=shape, dtype=dtype, fillvalue=fillvalue,
+                                chunks=self.get_chunks(shape, dtype), compression='gzip',
+                                maxshape=(None,) * len(shape) if resizable else None)
+
+    def get_dense(self, name, key):
+        """
+        Dense Data Set key of name Without Reading It, Memory-Mapped If Contiguous and Uncompressed, Otherwise a
+        LazyMatrix Read by Slicing.
+        """
+        filename = self.get_filename(name)
+        with h5py.File(filename, 'r') as f:
+            dataset = f[key]
+            offset = dataset.id.get_offset() if dataset.chunks is None and dataset.compression is None else None
+            shape, dtype = dataset.shape, dataset.dtype
+        if self.memmap and offset is not None:
+            return np.memmap(filename, mode='r', dtype=dtype, shape=shape, offset=offset)
+        return LazyMatrix(filename, key)
+
+    @staticmethod
+    def write_sparse(f, key, mat) -> None:
+        """
+        Persist a Sparse Matrix as data/indices/indptr Data Sets of a Group Rather than a Dense Array.
+        """
+        mat = sparse.csr_matrix(mat)
+        group = f.create_group(key)
+        group.attrs['shape'] = mat.shape
+        group.create_dataset('data', data=mat.data)
+        group.create_dataset('indices', data=mat.indices)
+        group.create_dataset('indptr', data=mat.indptr)
+
+    @staticmethod
+    def read_sparse(f, key):
+        group = f[key]
+        return sparse.csr_matrix((np.array(group['data']), np.array(group['indices']), np.array(group['indptr'])),
+                                 shape=tuple(group.attrs['shape']))
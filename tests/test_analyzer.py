@@ -0,0 +1,172 @@
+import os
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+from analyzer import BangumiAnalyzer, FactorizationAnalyzer
+from conf import Dev
+from pipeline import Pipeline, Stage
+from similarity import masked_pearson, UNDEFINED_SIMILARITY
+
+
+class FakeDB:
+    """
+    Authors of {mid: {media_id: score}} and Follows of {mid: [media_id, ...]}, Each Author Changed Gets a New
+    updated Time Like MongoDB Does.
+    """
+
+    def __init__(self, media_ids, ratings, follow=None) -> None:
+        self.media_ids = media_ids
+        self.ratings = {}
+        self.follow = {}
+        self.updated = {}
+        self.recommendation = {}
+        self.animes_top_matches = {}
+        self.calls = {'animes': 0, 'authors': 0}
+        self.failures = 0
+        for mid, scores in ratings.items():
+            self.set_author(mid, scores, (follow or {}).get(mid, []))
+
+    def set_author(self, mid, scores=None, follow=None) -> None:
+        if scores is not None:
+            self.ratings[mid] = dict(scores)
+        if follow is not None:
+            self.follow[mid] = list(follow)
+        self.follow.setdefault(mid, [])
+        self.updated[mid] = datetime.now()
+
+    def get_all_entrances(self):
+        return [{'media_id': media_id} for media_id in self.media_ids]
+
+    def get_valid_author_ratings_follow_pairs(self, since=None):
+        for mid in sorted(self.ratings):
+            if since is None or self.updated[mid] >= since:
+                yield mid, list(self.ratings[mid].items()), self.follow[mid]
+
+    def get_recently_analyzed_mids(self):
+        return set()
+
+    def update_animes_top_matches(self, items) -> None:
+        self.calls['animes'] += 1
+        self.animes_top_matches.update(items)
+
+    def update_authors_recommendation(self, items) -> None:
+        self.calls['authors'] += 1
+        if self.failures > 0:
+            self.failures -= 1
+            raise ConnectionError('Database Unavailable.')
+        for mid, _, recommendation in items:
+            self.recommendation[mid] = recommendation
+
+
+def make_conf(tmpdir, **attrs):
+    class TestConf(Dev):
+        HDF5_DIRECTORY = str(tmpdir.join('hdf5'))
+        PIPELINE_CHECKPOINT_FILENAME = str(tmpdir.join('pipeline.db'))
+        ANALYZE_WORKERS = 1
+        ANALYZE_BLOCK_SIZE = 4
+        ANALYZE_AUTHOR_TOP_MATCHES_SIZE = 3
+        ANALYZE_AUTHOR_RECOMMENDATION_SIZE = 3
+    for key, value in attrs.items():
+        setattr(TestConf, key, value)
+    return TestConf
+
+
+def make_ratings(authors_count, animes_count, seed):
+    random = np.random.RandomState(seed)
+    mat = random.randint(1, 11, (authors_count, animes_count)) * (random.random_sample((authors_count, animes_count))
+                                                                  < 0.6)
+    return {1000 + row: {100 + col: int(mat[row, col]) for col in np.flatnonzero(mat[row])}
+            for row in range(authors_count)}
+
+
+def expected_similarity(ref_mat):
+    expected = masked_pearson(ref_mat.toarray())
+    np.fill_diagonal(expected, UNDEFINED_SIMILARITY)
+    return expected
+
+
+def test_similarity_rebuilt_after_refs_removed(tmpdir):
+    conf = make_conf(tmpdir)
+    media_ids = list(range(100, 110))
+    db = FakeDB(media_ids, make_ratings(12, 10, seed=0))
+    analyzer = BangumiAnalyzer(db, conf)
+    ref_mat = analyzer.get_animes_authors_refs_matrix()[0]
+    analyzer.get_similarity_matrix(ref_mat.T, 'authors_similarity_matrix', 'mids_version')
+    analyzer.get_blocked_top_matches(ref_mat.tocsc(), 'animes_similarity_matrix', 3, 'media_ids_version')
+
+    # Versions of the New Build Start Over, Yet Matrices Derived from the Old One Must Not be Taken as Up to Date.
+    os.remove(analyzer.store.get_filename('animes_authors_refs'))
+    db = FakeDB(media_ids, make_ratings(12, 10, seed=1))
+    analyzer = BangumiAnalyzer(db, conf)
+    ref_mat = analyzer.get_animes_authors_refs_matrix()[0]
+    mat = analyzer.get_similarity_matrix(ref_mat.T, 'authors_similarity_matrix', 'mids_version')
+    np.testing.assert_allclose(np.asarray(mat[:]), expected_similarity(ref_mat.T), rtol=0, atol=1e-12)
+    _, similarities = analyzer.get_blocked_top_matches(ref_mat.tocsc(), 'animes_similarity_matrix', 3,
+                                                       'media_ids_version')
+    expected = expected_similarity(ref_mat.tocsc())
+    np.testing.assert_allclose(similarities, -np.sort(-expected, axis=1)[:, :3], rtol=0, atol=1e-12)
+
+
+def test_factors_trained_again_after_refs_removed(tmpdir):
+    conf = make_conf(tmpdir, ANALYZE_FACTORIZATION_RANK=2)
+    media_ids = list(range(100, 110))
+    analyzer = FactorizationAnalyzer(FakeDB(media_ids, make_ratings(12, 10, seed=0)), conf)
+    ref_mat, _, media_ids, mids = analyzer.get_animes_authors_refs_matrix()
+    analyzer.get_factors(ref_mat, media_ids, mids)
+
+    os.remove(analyzer.store.get_filename('animes_authors_refs'))
+    analyzer = FactorizationAnalyzer(FakeDB(list(media_ids), make_ratings(12, 10, seed=1)), conf)
+    ref_mat, _, media_ids, mids = analyzer.get_animes_authors_refs_matrix()
+    mean, _, _ = analyzer.get_factors(ref_mat, media_ids, mids)
+    assert mean == ref_mat.data.mean()
+
+
+def test_refs_reused_within_ttl_after_build(tmpdir):
+    conf = make_conf(tmpdir)
+    db = FakeDB(list(range(100, 110)), make_ratings(12, 10, seed=0))
+    built = BangumiAnalyzer(db, conf).get_animes_authors_refs_matrix()[0]
+
+    # Nothing Derived from It Marked It Updated, Yet It is Neither Patched Nor Versioned Again Until Expired.
+    db.set_author(1000, {100: 1, 101: 10})
+    analyzer = BangumiAnalyzer(db, conf)
+    ref_mat = analyzer.get_animes_authors_refs_matrix()[0]
+    assert (ref_mat != built).nnz == 0
+    with analyzer.store.open('animes_authors_refs') as f:
+        assert f.attrs['version'] == 1
+
+
+def make_pipeline(analyzer, conf):
+    crawl = Stage('crawl', lambda _: None)
+    return Pipeline([crawl] + analyzer.get_stages(inputs=[crawl.name]), conf.PIPELINE_CHECKPOINT_FILENAME)
+
+
+def test_pipeline_skips_and_resumes(tmpdir):
+    # Refs Matrix is Patched on Every Run Rather than Reused Within HDF5_DATA_SET_TTL.
+    conf = make_conf(tmpdir, HDF5_DATA_SET_TTL=0)
+    db = FakeDB(list(range(100, 116)), make_ratings(12, 16, seed=2))
+    pipeline = make_pipeline(BangumiAnalyzer(db, conf), conf)
+    pipeline.run()
+    assert db.calls == {'animes': 1, 'authors': 1}
+    mid = next(mid for mid, recommendation in sorted(db.recommendation.items()) if len(recommendation) > 1)
+
+    # Nothing Changed, Every Stage After refs_matrix is Skipped.
+    make_pipeline(BangumiAnalyzer(db, conf), conf).run()
+    assert db.calls == {'animes': 1, 'authors': 1}
+
+    # Only Follows Changed, Recommendation is Written Back Again Without Those Followed.
+    followed = db.recommendation[mid][:2]
+    db.set_author(mid, follow=followed)
+    make_pipeline(BangumiAnalyzer(db, conf), conf).run()
+    assert db.calls == {'animes': 1, 'authors': 2}
+    assert not set(followed) & set(db.recommendation[mid])
+
+    # Ratings Changed and Writing Back Failed, the Next Run Resumes at write_back.
+    db.set_author(mid, scores={**db.ratings[mid], 115: 10, 100: 1})
+    db.failures = 1
+    with pytest.raises(ConnectionError):
+        make_pipeline(BangumiAnalyzer(db, conf), conf).run()
+    assert db.calls == {'animes': 2, 'authors': 3}
+    make_pipeline(BangumiAnalyzer(db, conf), conf).run()
+    assert db.calls == {'animes': 2, 'authors': 4}
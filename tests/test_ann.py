@@ -0,0 +1,25 @@
+import numpy as np
+from scipy import sparse
+
+from ann import center_and_normalize, InvertedFileIndex, recall
+from benchmark import get_cosine_top_matches, make_ratings
+
+
+def test_probing_every_list_equals_exact_cosine():
+    refs = make_ratings(300, 60, 0.1, seed=0).toarray()
+    # Authors Not Rating or Rating the Same Everywhere Have No Direction, and are Never Matched.
+    refs[:2] = 0
+    refs[1, :3] = 7
+    refs = sparse.csr_matrix(refs)
+    exact_indexes, exact_similarities = get_cosine_top_matches(refs, 5, 64)
+
+    index = InvertedFileIndex(8, 8, seed=0).fit(refs)
+    indexes, similarities = index.query(5, 1000)
+    np.testing.assert_allclose(similarities, exact_similarities, rtol=0, atol=1e-12)
+    assert recall(exact_similarities, similarities) == 1
+    # Matches Only Differ Among Those Tied.
+    vectors = center_and_normalize(refs)
+    for row in np.flatnonzero(np.any(indexes != exact_indexes, axis=1)):
+        np.testing.assert_allclose((vectors[row] @ vectors[indexes[row]].T).toarray()[0], similarities[row],
+                                   rtol=0, atol=1e-12)
+    assert np.all(indexes[:2] == -1) and np.all(exact_indexes[:2] == -1)
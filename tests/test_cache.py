@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+from cache import LocalSimilarityCache, RedisSimilarityCache
+
+
+def make_redis_cache():
+    fakeredis = pytest.importorskip('fakeredis')
+    return RedisSimilarityCache(fakeredis.FakeRedis(), [1000 + i for i in range(16)], 60)
+
+
+@pytest.fixture(params=['local', 'redis'])
+def cache(request):
+    return LocalSimilarityCache(1024) if request.param == 'local' else make_redis_cache()
+
+
+def test_row_is_symmetric(cache):
+    cache.set_row(3, [1, 5, 7], [0.25, -0.5, 1.0])
+    np.testing.assert_allclose(cache.get_row(3, [7, 1, 5]), [1.0, 0.25, -0.5])
+    np.testing.assert_allclose(cache.get_row(5, [3]), [-0.5])
+    np.testing.assert_allclose(cache.get_row(1, [3, 5]), [0.25, np.nan])
+
+    cache.set_row(7, [3], [-1.0])
+    np.testing.assert_allclose(cache.get_row(3, [7]), [-1.0])
+
+
+def test_hits_and_misses_counted(cache):
+    assert len(cache.get_row(0, [])) == 0
+    cache.set_row(0, [1, 2], [0.5, 0.5])
+    cache.get_row(0, [1, 2, 3])
+    cache.get_row(2, [0, 4])
+    assert (cache.hits, cache.misses) == (3, 2)
+    assert cache.report() == '3 Hits, 2 Misses, 60.00% Hit Rate'
+
+
+def test_redis_keys_expire():
+    cache = make_redis_cache()
+    cache.set_row(4, [2], [0.75])
+    assert cache.get_keys(4, [2]) == ['1002:1004']
+    assert 0 < cache.redis.ttl('1002:1004') <= 60
+
+
+def find_keys_of_bucket(cache, count):
+    """
+    Pairs (0, col) Whose Keys Fall Into the Same Bucket, as Many as count.
+    """
+    cols = np.arange(1, 1 << 12)
+    buckets = cache.get_buckets(cache.pack(0, cols))
+    cols = cols[buckets == buckets[0]]
+    assert len(cols) >= count
+    return cols[:count]
+
+
+def test_local_evicts_least_recently_used():
+    cache = LocalSimilarityCache(8, ways=2)
+    first, second, third = find_keys_of_bucket(cache, 3)
+    cache.set_row(0, [first], [0.1])
+    cache.set_row(0, [second], [0.2])
+    cache.get_row(0, [first])
+    cache.set_row(0, [third], [0.3])
+    np.testing.assert_allclose(cache.get_row(0, [first, second, third]), [0.1, np.nan, 0.3], rtol=1e-6)
+
+
+def test_local_keeps_about_size_pairs():
+    cache = LocalSimilarityCache(256)
+    cols = np.arange(1, 4097)
+    cache.set_row(0, cols, np.linspace(-1, 1, len(cols)))
+    kept = np.count_nonzero(~np.isnan(cache.get_row(0, cols)))
+    assert 0 < kept <= cache.keys.size == 256
@@ -0,0 +1,243 @@
+import asyncio
+import json
+import os
+import socket
+from collections import defaultdict
+
+import pytest
+from aiohttp import web
+
+from conf import Dev
+from crawler import BangumiCrawler
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES, name), encoding='utf-8') as f:
+        return json.load(f)
+
+
+class StubServer:
+    """
+    Replay Recorded Responses of Bilibili APIs. failures Maps path_qs of a Request to How Many Times It is Answered
+    with 503 Before the Recorded Response, delays Maps path_qs of Reviews Requests to Seconds Before Answered, and
+    Every Request Served is Appended to requests.
+    """
+
+    def __init__(self) -> None:
+        self.index = load_fixture('index.json')
+        self.reviews = load_fixture('reviews.json')
+        self.follow = load_fixture('follow.json')
+        self.failures = defaultdict(int)
+        self.delays = {}
+        self.requests = []
+        self.runner = None
+        self.url = None
+
+    def replay(self, request, response):
+        self.requests.append(request.path_qs)
+        if self.failures[request.path_qs] > 0:
+            self.failures[request.path_qs] -= 1
+            return web.Response(status=503)
+        if response is None:
+            return web.Response(status=404)
+        return response
+
+    async def get_index(self, request):
+        page = self.index.get(request.query.get('page', '1'))
+        return self.replay(request, page and web.json_response(page))
+
+    async def get_season(self, request):
+        path = os.path.join(FIXTURES, 'seasoninfo', request.match_info['name'])
+        if not os.path.exists(path):
+            return self.replay(request, None)
+        with open(path, encoding='utf-8') as f:
+            return self.replay(request, web.Response(text=f.read(), content_type='application/javascript'))
+
+    async def get_reviews(self, request):
+        await asyncio.sleep(self.delays.get(request.path_qs, 0))
+        pages = self.reviews[request.match_info['type']].get(request.query['media_id'], {})
+        page = pages.get(request.query.get('cursor', ''))
+        return self.replay(request, page and web.json_response(page))
+
+    async def get_follow(self, request):
+        page = self.follow.get(request.query['mid'], {}).get(request.query.get('page', '1'))
+        return self.replay(request, page and web.json_response(page))
+
+    async def __aenter__(self):
+        app = web.Application()
+        app.router.add_get('/web_api/season/index_global', self.get_index)
+        app.router.add_get('/jsonp/seasoninfo/{name}', self.get_season)
+        app.router.add_get('/review/web_api/{type}/list', self.get_reviews)
+        app.router.add_get('/ajax/Bangumi/getList', self.get_follow)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            port = s.getsockname()[1]
+        await web.TCPSite(self.runner, '127.0.0.1', port).start()
+        self.url = 'http://127.0.0.1:%s' % port
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        await self.runner.cleanup()
+
+
+class StubDB:
+    def __init__(self, entrances=None, mids=()) -> None:
+        self.animes = {}
+        self.reviews = {}
+        self.cursors = {}
+        self.follow = {}
+        self.entrances = entrances
+        self.mids = mids
+
+    def persist_animes(self, animes) -> None:
+        for anime in animes:
+            self.animes[anime['season_id']] = anime
+
+    def persist_review_pages(self, pages) -> None:
+        for media_id, reviews, cursor, is_long in pages:
+            for review in reviews:
+                self.reviews[review['review_id']] = review
+            self.cursors[(media_id, is_long)] = cursor
+
+    def get_all_entrances(self):
+        if self.entrances is not None:
+            return [dict(entrance) for entrance in self.entrances]
+        return [{'media_id': anime['media_id'],
+                 'last_long_reviews_cursor': self.cursors.get((anime['media_id'], True)),
+                 'last_short_reviews_cursor': self.cursors.get((anime['media_id'], False))}
+                for anime in self.animes.values()]
+
+    def get_author_tasks(self):
+        return [{'mid': mid} for mid in self.mids]
+
+    def push_to_follow(self, mid, season_ids) -> None:
+        self.follow[mid] = season_ids
+
+
+def make_conf(tmpdir):
+    class TestConf(Dev):
+        CRAWL_VALIDATORS_FILENAME = str(tmpdir.join('validators.db'))
+        CRAWL_RATE = 1024
+        CRAWL_RATES = {}
+        CRAWL_REQUEST_RETRY = 2
+        CRAWL_BACKOFF_BASE = 0.001
+        CRAWL_BACKOFF_MAX = 0.01
+        CRAWL_REVIEWS_QUEUE_SIZE = 4
+        CRAWL_REVIEWS_BATCH_SIZE = 2
+    return TestConf
+
+
+async def crawl(db, conf, process, *args, failures=None, delays=None):
+    """
+    Run process of a Crawler Against a Fresh Stub Server, Return (Result, Stub Server).
+    """
+    async with StubServer() as stub:
+        stub.failures.update(failures or {})
+        stub.delays.update(delays or {})
+        crawler = BangumiCrawler(db, conf)
+        crawler.BANGUMI_URL = crawler.SPACE_URL = crawler.AUTH_URL = stub.url
+        return await crawler.with_fetcher(getattr(crawler, process), *args), stub
+
+
+def run(db, conf, process, *args, failures=None, delays=None):
+    return asyncio.run(crawl(db, conf, process, *args, failures=failures, delays=delays))
+
+
+def entrances(*cursors):
+    media_ids = [102392, 102791, 110921]
+    return [{'media_id': media_id, 'last_long_reviews_cursor': long_cursor, 'last_short_reviews_cursor': short_cursor}
+            for media_id, (long_cursor, short_cursor) in zip(media_ids, cursors)]
+
+
+def test_process_index_and_animes(tmpdir):
+    conf, db = make_conf(tmpdir), StubDB()
+    todo, _ = run(db, conf, 'process_index')
+    assert sorted(int(raw_result['season_id']) for raw_result in todo) == [5978, 6339, 21466]
+
+    progresses = []
+    (todo_left, retry), stub = run(db, conf, 'process_animes', todo, 4, progresses.append, failures={
+        '/jsonp/seasoninfo/6339.ver?callback=seasonListCallback&jsonp=jsonp': 3})
+    assert (todo_left, retry) == (0, 2)
+    assert [len(todo) for todo in progresses] == [1, 0]
+    assert sorted(db.animes) == [5978, 6339, 21466]
+    anime = db.animes[5978]
+    assert anime['media_id'] == 102392 and anime['title'] == '来自深渊' and anime['episodes'] == 13
+    assert anime['rating'] == {'count': 20000, 'score': 9.5} and anime['is_finish'] is True
+    assert stub.requests.count('/jsonp/seasoninfo/5978.ver?callback=seasonListCallback&jsonp=jsonp') == 1
+
+
+def test_process_reviews(tmpdir):
+    conf = make_conf(tmpdir)
+    db = StubDB(entrances(*[(None, None)] * 3))
+    (entrances_left, retry), stub = run(db, conf, 'process_reviews', 4)
+    assert (entrances_left, retry) == (0, 1)
+    assert len([review for review in db.reviews.values() if review['is_long']]) == 9
+    assert len([review for review in db.reviews.values() if not review['is_long']]) == 8
+    review = db.reviews[39200]
+    assert review['author']['mid'] == 1000 and review['title'] == '第0篇' and review['score'] == 10.0
+    assert db.cursors[(102392, True)] == '78000002000' and db.cursors[(110921, False)] == '78000001000'
+
+
+def test_process_reviews_resumes_from_cursor(tmpdir):
+    conf = make_conf(tmpdir)
+    db = StubDB(entrances(('78000001000', None), ('78000002000', '78000002000'), (None, None)))
+    (entrances_left, _), stub = run(db, conf, 'process_reviews', 4)
+    assert entrances_left == 0
+    assert '/review/web_api/long/list?media_id=102392' not in stub.requests
+    assert sorted(review_id for review_id, review in db.reviews.items() if review['media_id'] == 102392
+                  and review['is_long']) == [39202]
+    assert not any(review['media_id'] == 102791 for review in db.reviews.values())
+
+
+def test_process_reviews_retries_from_committed_cursor(tmpdir):
+    conf = make_conf(tmpdir)
+    db = StubDB(entrances(*[(None, None)] * 3))
+    # Page After the First One of Long Reviews Keeps Failing Longer than Retries of a Single Request.
+    broken = '/review/web_api/long/list?media_id=102392&cursor=78000001000'
+    (entrances_left, retry), stub = run(db, conf, 'process_reviews', 4, failures={broken: 3})
+    assert (entrances_left, retry) == (0, 2)
+    assert stub.requests.count('/review/web_api/long/list?media_id=102392') == 1
+    assert stub.requests.count(broken) == 4
+    assert len(db.reviews) == 17
+
+
+def test_process_reviews_awaits_both_types_when_one_fails(tmpdir):
+    conf = make_conf(tmpdir)
+    db = StubDB(entrances(*[(None, None)] * 3))
+    # First Request of Long Reviews Fails, While Short Reviews of the Same Anime are Still Being Crawled.
+    broken = '/review/web_api/long/list?media_id=102392'
+    slow = '/review/web_api/short/list?media_id=102392&cursor=78000001000'
+    (entrances_left, retry), stub = run(db, conf, 'process_reviews', 4, failures={broken: 2}, delays={slow: 0.2})
+    assert (entrances_left, retry) == (0, 2)
+    assert stub.requests.count(slow) == 1
+    assert db.cursors[(102392, False)] == '78000002000' and db.cursors[(102392, True)] == '78000002000'
+    assert len(db.reviews) == 17
+
+
+def test_process_authors(tmpdir):
+    conf = make_conf(tmpdir)
+    db = StubDB(mids=(1000, 1001))
+    (tasks_left, retry), stub = run(db, conf, 'process_authors', 4,
+                                    failures={'/ajax/Bangumi/getList?mid=1000&page=2': 1})
+    assert (tasks_left, retry) == (0, 1)
+    assert sorted(db.follow[1000]) == [5978, 6339, 21466]
+    assert db.follow[1001] == []
+
+
+class UnavailableDB(StubDB):
+    def persist_review_pages(self, pages) -> None:
+        raise ConnectionError('Database Unavailable.')
+
+
+def test_process_reviews_raises_when_persisting_fails(tmpdir):
+    conf = make_conf(tmpdir)
+    db = UnavailableDB(entrances(*[(None, None)] * 3))
+
+    # Pages Queued Outnumber CRAWL_REVIEWS_QUEUE_SIZE, Producers Must Not be Left Blocked on the Full Queue.
+    with pytest.raises(ConnectionError):
+        asyncio.run(asyncio.wait_for(crawl(db, conf, 'process_reviews', 4), 10))
+    assert db.cursors == {}
@@ -0,0 +1,48 @@
+import pytest
+
+from conf import Dev
+from db import BulkWriter, MongoDB
+
+
+class ReversingCollection:
+    """
+    Collection Applying Operations of Unordered bulk_write in Reverse, Which MongoDB is Free to Do.
+    """
+
+    def __init__(self, collection) -> None:
+        self.collection = collection
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+    def bulk_write(self, operations, ordered=True):
+        return self.collection.bulk_write(operations if ordered else operations[::-1], ordered=ordered)
+
+
+def make_db():
+    mongomock = pytest.importorskip('mongomock')
+    db = MongoDB.__new__(MongoDB)
+    db.conf, db.media_ids = Dev, None
+    db.client = mongomock.MongoClient()
+    db.db = db.client.bangumi
+    return db
+
+
+def make_review(review_id, media_id, mid, is_long=True):
+    return {'review_id': review_id, 'media_id': media_id, 'is_long': is_long, 'score': 8, 'mtime': review_id,
+            'author': {'mid': mid, 'uname': str(mid)}}
+
+
+def test_persist_review_pages_keeps_last_cursor():
+    db = make_db()
+    db.db.animes.insert_one({'media_id': 1})
+    db.get_bulk_writer = lambda c: BulkWriter(ReversingCollection(c), Dev.DB_BULK_SIZE, Dev.DB_BULK_INTERVAL)
+    db.persist_review_pages([(1, [make_review(10, 1, 100)], '1000', True),
+                             (1, [make_review(11, 1, 101, False)], '2000', False),
+                             (1, [make_review(12, 1, 100)], '3000', True),
+                             (1, [], None, True)])
+
+    anime = db.db.animes.find_one({'media_id': 1})
+    assert anime['last_long_reviews_cursor'] == '3000' and anime['last_short_reviews_cursor'] == '2000'
+    assert db.db.reviews.count_documents({}) == 3
+    assert db.db.authors.find_one({'mid': 100})['reviews_count'] == 2
@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+from scipy import sparse
+
+import analyzer
+from analyzer import FactorizationAnalyzer
+from factorization import factorize, get_error, init_factors, solve_factors
+from test_analyzer import FakeDB, make_conf, make_ratings
+
+
+def make_low_rank_ratings(rows, cols, rank, density, seed):
+    random = np.random.RandomState(seed)
+    full = 5 + random.standard_normal((rows, rank)) @ random.standard_normal((cols, rank)).T
+    rated = random.random_sample((rows, cols)) < density
+    return sparse.csr_matrix(np.where(rated, full, 0))
+
+
+def per_row_factors(ratings, fixed, regularization):
+    """
+    Reference Factors by One Regularized Least Squares Solve per Row Over Its Rated Columns.
+    """
+    rank = fixed.shape[1]
+    factors = np.zeros((ratings.shape[0], rank))
+    for row in range(ratings.shape[0]):
+        cols = ratings.indices[ratings.indptr[row]:ratings.indptr[row + 1]]
+        values = ratings.data[ratings.indptr[row]:ratings.indptr[row + 1]]
+        gram = fixed[cols].T @ fixed[cols] + regularization * max(len(cols), 1) * np.eye(rank)
+        factors[row] = np.linalg.solve(gram, fixed[cols].T @ values)
+    return factors
+
+
+@pytest.mark.parametrize('max_ratings', [1, 7, 1000])
+def test_solve_factors_equals_per_row_least_squares(max_ratings):
+    ratings = make_low_rank_ratings(30, 12, 3, 0.4, seed=0).toarray()
+    # Rows with No Ratings Get Zero Factors.
+    ratings[[4, 17]] = 0
+    ratings = sparse.csr_matrix(ratings)
+    fixed = init_factors(12, 3, seed=1)
+    np.testing.assert_allclose(solve_factors(ratings, fixed, 0.1, max_ratings), per_row_factors(ratings, fixed, 0.1),
+                               rtol=1e-10, atol=1e-12)
+    assert np.all(solve_factors(ratings, fixed, 0.1, max_ratings)[[4, 17]] == 0)
+
+
+def test_factorize_fits_low_rank_ratings():
+    ratings = make_low_rank_ratings(200, 60, 3, 0.5, seed=2)
+    mean, authors_factors, animes_factors = factorize(ratings, 3, 16, 1e-4, 64, seed=0)
+    assert mean == pytest.approx(ratings.data.mean())
+    assert authors_factors.shape == (200, 3) and animes_factors.shape == (60, 3)
+    assert get_error(ratings, mean, authors_factors, animes_factors) < 0.05
+
+    # Warm Started from Fitted Factors, a Single Iteration is About as Good.
+    warm = factorize(ratings, 3, 1, 1e-4, 64, animes_factors)
+    assert get_error(ratings, *warm) < 0.05
+    assert get_error(ratings, *factorize(ratings, 3, 1, 1e-4, 64, seed=0)) > 0.05
+
+
+def test_get_factors_warm_starts_from_stored(tmpdir, monkeypatch):
+    conf = make_conf(tmpdir, ANALYZE_FACTORIZATION_RANK=2, ANALYZE_FACTORIZATION_ITERATIONS=4,
+                     ANALYZE_FACTORIZATION_WARM_ITERATIONS=1, HDF5_DATA_SET_TTL=0)
+    trained = []
+
+    def record_factorize(ratings, rank, iterations, regularization, max_ratings, animes_factors=None, seed=None):
+        trained.append((iterations, None if animes_factors is None else animes_factors.copy()))
+        return factorize(ratings, rank, iterations, regularization, max_ratings, animes_factors, seed)
+
+    monkeypatch.setattr(analyzer, 'factorize', record_factorize)
+    db = FakeDB(list(range(100, 110)), make_ratings(12, 10, seed=0))
+    factorization_analyzer = FactorizationAnalyzer(db, conf)
+    ref_mat, _, media_ids, mids = factorization_analyzer.get_animes_authors_refs_matrix()
+    _, _, animes_factors = factorization_analyzer.get_factors(ref_mat, media_ids, mids)
+    assert len(trained) == 1 and trained[0] == (4, None)
+
+    # Up to Date with Refs Matrix, Stored Factors are Returned Without Training.
+    factorization_analyzer.get_factors(ref_mat, media_ids, mids)
+    assert len(trained) == 1
+
+    # A New Anime Rated, Known Animes Start from Their Stored Factors and Only Warm Iterations are Run.
+    db.media_ids.append(110)
+    db.set_author(1000, {**db.ratings[1000], 110: 9})
+    ref_mat, _, media_ids, mids = factorization_analyzer.get_animes_authors_refs_matrix()
+    factorization_analyzer.get_factors(ref_mat, media_ids, mids)
+    iterations, warm_factors = trained[1]
+    assert iterations == 1 and warm_factors.shape == (11, 2)
+    np.testing.assert_array_equal(warm_factors[:10], animes_factors)
+
+    # Stored Factors Follow media_ids Rather than Their Position.
+    with factorization_analyzer.store.open('factorization') as f:
+        stored_media_ids, stored_factors = np.array(f['media_ids']), np.array(f['animes_factors'])
+        rearranged = factorization_analyzer.get_warm_animes_factors(f, [999] + list(stored_media_ids[::-1]), 2)
+    np.testing.assert_array_equal(rearranged[1:], stored_factors[::-1])
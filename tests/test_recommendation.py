@@ -0,0 +1,22 @@
+import numpy as np
+from scipy import sparse
+
+from recommendation import neighbours_matrix, top_neighbours
+from similarity import masked_pearson, UNDEFINED_SIMILARITY
+
+
+def test_top_neighbours_require_co_raters():
+    random = np.random.RandomState(0)
+    ratings = random.randint(1, 11, (80, 12)) * (random.random_sample((80, 12)) < np.linspace(0.1, 0.9, 12))
+    ratings = sparse.csr_matrix(ratings)
+    similarities = masked_pearson(ratings.tocsc())
+    np.fill_diagonal(similarities, UNDEFINED_SIMILARITY)
+    rated = (ratings > 0).astype('int64')
+    co_raters = (rated.T @ rated).toarray()
+
+    indexes, values = top_neighbours(ratings, similarities, 4, 20, block_size=5)
+    expected = np.where(co_raters >= 20, similarities, UNDEFINED_SIMILARITY)
+    np.testing.assert_allclose(values, -np.sort(-expected, axis=1)[:, :4])
+    neighbours = neighbours_matrix(indexes, values).tocoo()
+    assert neighbours.nnz > 0
+    assert np.all(co_raters[neighbours.row, neighbours.col] >= 20) and np.all(neighbours.data > 0)
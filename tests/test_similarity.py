@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+from scipy import sparse
+from scipy.stats import pearsonr
+
+from similarity import iter_masked_pearson_patches, iter_masked_pearson_tiles, masked_pearson, mirror_tiles, \
+    UNDEFINED_SIMILARITY
+
+
+def make_ratings(rows, cols, density, seed):
+    """
+    Random int8 Ratings in 1-10, 0 Meaning Not Rated, with Columns Hitting Every Special Case Appended: One with
+    a Single Rating, One Rated the Same Everywhere (Zero Variance) and One Never Rated.
+    """
+    random = np.random.RandomState(seed)
+    mat = random.randint(1, 11, (rows, cols)) * (random.random_sample((rows, cols)) < density)
+    single, constant, empty = np.zeros(rows), np.where(random.random_sample(rows) < 0.5, 7, 0), np.zeros(rows)
+    single[0] = 5
+    return np.column_stack((mat, single, constant, empty)).astype('int8')
+
+
+def per_pair_pearson(mat):
+    """
+    Reference Similarities by One pearsonr Call per Pair of Columns Over Their Co-Rated Rows.
+    """
+    cols_count = mat.shape[1]
+    result = np.full((cols_count, cols_count), UNDEFINED_SIMILARITY, dtype='float64')
+    for i in range(cols_count):
+        for j in range(cols_count):
+            shared = np.logical_and(mat[:, i] > 0, mat[:, j] > 0)
+            lhs, rhs = mat[shared, i].astype('float64'), mat[shared, j].astype('float64')
+            if len(lhs) >= 2 and lhs.std() > 0 and rhs.std() > 0:
+                result[i, j] = pearsonr(lhs, rhs)[0]
+    return result
+
+
+@pytest.mark.parametrize('density', [0.9, 0.3])
+@pytest.mark.parametrize('is_sparse', [False, True])
+def test_masked_pearson_equals_per_pair_pearson(density, is_sparse):
+    mat = make_ratings(60, 24, density, seed=int(density * 10))
+    expected = per_pair_pearson(mat)
+    result = masked_pearson(sparse.csr_matrix(mat) if is_sparse else mat)
+    assert result.shape == expected.shape
+    np.testing.assert_allclose(result, expected, rtol=0, atol=1e-12)
+    # Single Rating, Zero Variance and Never Rated Columns are Undefined Against Everything.
+    assert np.all(result[-3:] == UNDEFINED_SIMILARITY) and np.all(result[:, -3:] == UNDEFINED_SIMILARITY)
+
+
+def test_masked_pearson_between_different_columns():
+    lhs, rhs = make_ratings(40, 10, 0.5, seed=1), make_ratings(40, 6, 0.5, seed=2)
+    expected = per_pair_pearson(np.hstack((lhs, rhs)))[:lhs.shape[1], lhs.shape[1]:]
+    np.testing.assert_allclose(masked_pearson(lhs, rhs), expected, rtol=0, atol=1e-12)
+    np.testing.assert_allclose(masked_pearson(sparse.csr_matrix(lhs), sparse.csr_matrix(rhs)), expected,
+                               rtol=0, atol=1e-12)
+
+
+@pytest.mark.parametrize('is_sparse', [False, True])
+def test_tiles_and_rows_equal_full_matrix(is_sparse):
+    mat = make_ratings(50, 29, 0.4, seed=3)
+    expected = masked_pearson(mat)
+    np.fill_diagonal(expected, UNDEFINED_SIMILARITY)
+    mat = sparse.csr_matrix(mat) if is_sparse else mat
+
+    # Only Tiles on and Above the Diagonal are Calculated, Each Exactly Once.
+    tiles = list(iter_masked_pearson_tiles(mat, 8))
+    assert len(tiles) == 4 * 5 // 2 and all(rows.start <= cols.start for rows, cols, _ in tiles)
+    tiled = np.full(expected.shape, np.nan)
+    for rows, cols, tile in mirror_tiles(tiles):
+        assert np.all(np.isnan(tiled[rows, cols]))
+        tiled[rows, cols] = tile
+    np.testing.assert_allclose(tiled, expected, rtol=0, atol=1e-12)
+
+    # Stale Entries Patched Over a Matrix of Garbage Bring It Up to Date Only Where Rows or Columns are Stale.
+    indexes = np.array([27, 3, 4, 15, 0])
+    patched_mat = np.full(expected.shape, np.nan)
+    for rows, cols, tile, patched in mirror_tiles(iter_masked_pearson_patches(mat, indexes, 8)):
+        assert tile.shape == patched.shape == (rows.stop - rows.start, cols.stop - cols.start)
+        patched_mat[rows, cols][patched] = tile[patched]
+    stale = np.zeros(expected.shape[0], dtype='bool')
+    stale[indexes] = True
+    is_stale = np.logical_or(stale[:, None], stale[None, :])
+    np.testing.assert_allclose(patched_mat[is_stale], expected[is_stale], rtol=0, atol=1e-12)
+    assert np.all(np.isnan(patched_mat[~is_stale]))
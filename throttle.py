@@ -0,0 +1,134 @@
+import asyncio
+import random
+import time
+from collections import defaultdict
+
+# Statuses Meaning the Server is Throttling or Overloaded, Requests Will be Retried After Backoff.
+THROTTLED_STATUSES = {412, 429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    async def acquire(self) -> None:
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class AIMDLimiter:
+    """
+    Concurrency Limit Increased Additively (About 1 per Limit Requests) While Responses are Healthy, and Halved
+    Whenever a Response Shows Congestion.
+    """
+
+    def __init__(self, limit, minimum=1) -> None:
+        self.maximum = limit
+        self.minimum = minimum
+        self.limit = float(limit)
+        self.active = 0
+        self.condition = asyncio.Condition()
+
+    async def acquire(self) -> None:
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.active < int(self.limit))
+            self.active += 1
+
+    async def release(self, is_congested) -> None:
+        async with self.condition:
+            self.active -= 1
+            if is_congested:
+                self.limit = max(self.minimum, self.limit / 2)
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+
+class EndpointStats:
+    def __init__(self) -> None:
+        self.started = time.monotonic()
+        self.requests = 0
+        self.succeeded = 0
+        self.throttled = 0
+        self.failed = 0
+        self.latency = 0.0
+
+    def __str__(self) -> str:
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        return '%s Requests, %s Succeeded, %s Throttled, %s Failed, %.2f Effective Requests/s, %.3fs Mean Latency' % (
+            self.requests, self.succeeded, self.throttled, self.failed, self.succeeded / elapsed,
+            self.latency / max(self.requests, 1))
+
+
+class Scheduler:
+    """
+    Every Request of an Endpoint Waits for a Token of Its Bucket and a Slot of Its AIMD Limiter, Throttled or
+    Failed Ones are Retried with Exponential Backoff and Full Jitter.
+    """
+
+    def __init__(self, conf) -> None:
+        self.conf = conf
+        self.buckets = {}
+        self.limiters = {}
+        self.stats = defaultdict(EndpointStats)
+
+    def get_bucket(self, endpoint):
+        if endpoint not in self.buckets:
+            rate = self.conf.CRAWL_RATES.get(endpoint, self.conf.CRAWL_RATE)
+            self.buckets[endpoint] = TokenBucket(rate, max(1, self.conf.CRAWL_BURST))
+        return self.buckets[endpoint]
+
+    def get_limiter(self, endpoint):
+        if endpoint not in self.limiters:
+            self.limiters[endpoint] = AIMDLimiter(self.conf.CRAWL_CONCURRENCY_PER_ENDPOINT)
+        return self.limiters[endpoint]
+
+    async def backoff(self, attempt) -> None:
+        delay = min(self.conf.CRAWL_BACKOFF_MAX, self.conf.CRAWL_BACKOFF_BASE * 2 ** attempt)
+        await asyncio.sleep(random.uniform(0, delay))
+
+    async def schedule(self, endpoint, send, error_type):
+        """
+        Await send() Returning (status, ...) Under Limits of endpoint, send() Raises error_type on Failure.
+        """
+        bucket, limiter, stats = self.get_bucket(endpoint), self.get_limiter(endpoint), self.stats[endpoint]
+        error = None
+        for attempt in range(self.conf.CRAWL_REQUEST_RETRY):
+            await bucket.acquire()
+            await limiter.acquire()
+            response, status, start = None, None, time.monotonic()
+            try:
+                response = await send()
+                status = response[0]
+            except error_type as e:
+                error = e
+            finally:
+                latency = time.monotonic() - start
+                is_throttled = status is None or status in THROTTLED_STATUSES
+                await limiter.release(is_throttled or latency > self.conf.CRAWL_LATENCY_THRESHOLD)
+                stats.requests += 1
+                stats.latency += latency
+                if status is None:
+                    stats.failed += 1
+                elif status in THROTTLED_STATUSES:
+                    stats.throttled += 1
+                else:
+                    stats.succeeded += 1
+            if not is_throttled:
+                return response
+            await self.backoff(attempt)
+        if error is not None:
+            raise error
+        raise error_type('%s Still Throttled After %s Attempts.' % (endpoint, self.conf.CRAWL_REQUEST_RETRY))
+
+    def report(self):
+        return ['%s: %s.' % (endpoint, stats) for endpoint, stats in sorted(self.stats.items())]